@@ -0,0 +1,292 @@
+import numpy as np
+from typing import Optional
+from engine import ROTATIONS, KICKS, ROWS, COLS
+
+"""
+Vectorized version of the Engine rules for running thousands of games in lockstep.
+Every board is a slice of one (games, height, width) array and every rule is applied to all games at once with NumPy.
+"""
+
+# Action codes for BatchEngine.update, one action per game per frame
+NOOP = 0
+LEFT = 1
+RIGHT = 2
+ROTATE = 3
+DOWN = 4
+HARD_DROP = 5
+
+# Points for 0-4 cleared lines, same as Engine.tetris()
+LINE_SCORES = np.array([0, 40, 80, 300, 1200], dtype=np.int64)
+
+# ROTATION_CELLS[shape_id, rotation] = 4 (row, col) offsets from the top left corner of the rotation box
+ROTATION_CELLS = np.array(ROTATIONS, dtype=np.int64)
+
+# Kick lists have different lengths, pad them and keep a mask of the real ones
+MAX_KICKS = max(len(kicks) for kicks in KICKS)
+KICK_OFFSETS = np.zeros((len(KICKS), MAX_KICKS, 2), dtype=np.int64)
+KICK_VALID = np.zeros((len(KICKS), MAX_KICKS), dtype=bool)
+for _shape_id, _kicks in enumerate(KICKS):
+    KICK_OFFSETS[_shape_id, :len(_kicks)] = _kicks
+    KICK_VALID[_shape_id, :len(_kicks)] = True
+
+
+class BatchEngine:
+    """
+    Runs many games with the same rules as Engine:
+
+    1. Key events (here one action per game) move, rotate or drop the falling shape
+    2. If tetris mode: move rows above the cleared line down by one and skip the rest of the frame
+    3. Every self.speed frames gravity moves the falling shape down or locks it
+    4. No falling shape and no tetris mode: end the game if top 2 rows are taken, otherwise spawn
+
+    Boards only hold occupancy (colors are a renderer thing). Games that end are masked out of every
+    rule, or reset to an empty board when auto_reset is set.
+    """
+
+    def __init__(self, games: int, seed: Optional[int] = None, auto_reset: bool = False, width: int = COLS,
+                 height: int = ROWS):
+        self.games = games
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+        self.width = width
+        self.height = height
+
+        self.boards = np.zeros((games, height, width), dtype=np.uint8)
+
+        # Falling shape, row and col are the top left corner of the rotation box like in Engine
+        self.shape_id = np.zeros(games, dtype=np.int64)
+        self.rotation = np.zeros(games, dtype=np.int64)
+        self.row = np.zeros(games, dtype=np.int64)
+        self.col = np.zeros(games, dtype=np.int64)
+        self.next_shape = np.zeros(games, dtype=np.int64)
+
+        # 7-bag for every game, refilled with new permutation when used up
+        self.bag = np.zeros((games, 7), dtype=np.int64)
+        self.bag_position = np.full(games, 7, dtype=np.int64)
+
+        self.frames = np.zeros(games, dtype=np.int64)
+        self.speed = np.full(games, 30, dtype=np.int64)
+        self.level = np.zeros(games, dtype=np.int64)
+        self.score = np.zeros(games, dtype=np.int64)
+        self.total_tetris_rows = np.zeros(games, dtype=np.int64)
+        self.pieces_locked = np.zeros(games, dtype=np.int64)
+
+        self.spawn_new = np.ones(games, dtype=bool)
+        self.game_end = np.zeros(games, dtype=bool)
+
+        # Tetris memory
+        self.prev_tetris_row = np.zeros(games, dtype=np.int64)
+        self.tetris_bottom_row = np.zeros(games, dtype=np.int64)
+        self.has_next_shape = np.zeros(games, dtype=bool)
+
+        # Finished games when auto_reset is on: (score, level, lines, pieces, frames)
+        self.finished = []
+
+        self.row_index = np.arange(height)
+
+    def reset(self, mask: np.ndarray) -> None:
+        """
+        Reset selected games to empty board
+        :param mask: bool array with True for every game to reset
+        """
+        self.boards[mask] = 0
+        self.frames[mask] = 0
+        self.speed[mask] = 30
+        self.level[mask] = 0
+        self.score[mask] = 0
+        self.total_tetris_rows[mask] = 0
+        self.pieces_locked[mask] = 0
+        self.spawn_new[mask] = True
+        self.game_end[mask] = False
+        self.prev_tetris_row[mask] = 0
+        self.has_next_shape[mask] = False
+        self.bag_position[mask] = 7
+
+    def draw_shapes(self, games: np.ndarray) -> np.ndarray:
+        """
+        Take next shape from the bag of every given game, same as Engine.get_next_shape()
+        :param games: int array of game indexes
+        :return: shape id for every game
+        """
+        empty = games[self.bag_position[games] == 7]
+        if len(empty) != 0:
+            self.bag[empty] = self.rng.permuted(np.tile(np.arange(7), (len(empty), 1)), axis=1)
+            self.bag_position[empty] = 0
+
+        shapes = self.bag[games, self.bag_position[games]]
+        self.bag_position[games] += 1
+        return shapes
+
+    def shape_fits(self, games, shape_id, rotation, row, col) -> np.ndarray:
+        """
+        Vectorized Engine.shape_fits, every argument has one value per game
+        :return: bool array, True where shape fits
+        """
+        cells = ROTATION_CELLS[shape_id, rotation]
+        rows = cells[:, :, 0] + row[:, None]
+        cols = cells[:, :, 1] + col[:, None]
+        inside = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+
+        # Out of bounds cells are clipped for the lookup, inside mask makes them collide anyway
+        rows = np.clip(rows, 0, self.height - 1)
+        cols = np.clip(cols, 0, self.width - 1)
+        taken = self.boards[games[:, None], rows, cols] != 0
+        return np.all(inside & ~taken, axis=1)
+
+    def manual_move(self, games: np.ndarray, col_change: int) -> None:
+        new_col = self.col[games] + col_change
+        fits = self.shape_fits(games, self.shape_id[games], self.rotation[games], self.row[games], new_col)
+        self.col[games[fits]] = new_col[fits]
+
+    def manual_rotate(self, games: np.ndarray) -> None:
+        shape_id = self.shape_id[games]
+        new_rotation = (self.rotation[games] + 1) % 4
+        pending = np.ones(len(games), dtype=bool)
+
+        # Try kicks in order, the first one that fits wins
+        for kick in range(MAX_KICKS):
+            trying = pending & KICK_VALID[shape_id, kick]
+            if not trying.any():
+                continue
+
+            new_row = self.row[games] + KICK_OFFSETS[shape_id, kick, 0]
+            new_col = self.col[games] + KICK_OFFSETS[shape_id, kick, 1]
+            fits = trying & self.shape_fits(games, shape_id, new_rotation, new_row, new_col)
+
+            rotated = games[fits]
+            self.rotation[rotated] = new_rotation[fits]
+            self.row[rotated] = new_row[fits]
+            self.col[rotated] = new_col[fits]
+            pending &= ~fits
+
+    def move_down(self, games: np.ndarray) -> None:
+        # Move falling shapes one row down or lock them when they collide
+        fits = self.shape_fits(games, self.shape_id[games], self.rotation[games], self.row[games] + 1,
+                               self.col[games])
+        self.row[games[fits]] += 1
+        self.lock_piece(games[~fits])
+
+    def hard_drop(self, games: np.ndarray) -> None:
+        # Move shapes down until they do not fit anymore and lock them
+        dropping = games
+        while len(dropping) != 0:
+            fits = self.shape_fits(dropping, self.shape_id[dropping], self.rotation[dropping], self.row[dropping] + 1,
+                                   self.col[dropping])
+            dropping = dropping[fits]
+            self.row[dropping] += 1
+
+        self.lock_piece(games)
+
+    def lock_piece(self, games: np.ndarray) -> None:
+        if len(games) == 0:
+            return
+
+        cells = ROTATION_CELLS[self.shape_id[games], self.rotation[games]]
+        rows = cells[:, :, 0] + self.row[games][:, None]
+        cols = cells[:, :, 1] + self.col[games][:, None]
+        self.boards[games[:, None], rows, cols] = 1
+
+        self.tetris(games)
+        self.spawn_new[games] = True
+        self.pieces_locked[games] += 1
+
+    def tetris(self, games: np.ndarray) -> None:
+        # Clear full rows of given games and update score, level and speed
+        if len(games) == 0:
+            return
+
+        full = np.all(self.boards[games] != 0, axis=2)
+        tetris_count = full.sum(axis=1)
+        cleared = tetris_count != 0
+        if not cleared.any():
+            return
+
+        games, full, tetris_count = games[cleared], full[cleared], tetris_count[cleared]
+        self.boards[games] *= ~full[:, :, None]
+
+        # Tetris mode moves the rows above the lowest cleared row down
+        self.prev_tetris_row[games] += tetris_count
+        self.tetris_bottom_row[games] = self.height - 1 - np.argmax(full[:, ::-1], axis=1)
+
+        self.total_tetris_rows[games] += tetris_count
+        self.score[games] += LINE_SCORES[np.minimum(tetris_count, 4)] * (self.level[games] + 1)
+        self.level[games] = self.total_tetris_rows[games] // 10
+        self.speed[games] = np.maximum(30 - self.level[games] * 2, 1)
+
+    def tetris_move(self, games: np.ndarray) -> None:
+        # Every row from 1 to tetris_bottom_row takes the value of the row above, top row stays as it is
+        boards = self.boards[games]
+        shifted = boards.copy()
+        shifted[:, 1:] = boards[:, :-1]
+        moving = (self.row_index[None, :] <= self.tetris_bottom_row[games][:, None]) & (self.row_index[None, :] > 0)
+        self.boards[games] = np.where(moving[:, :, None], shifted, boards)
+
+    def spawn_shape(self, games: np.ndarray) -> None:
+        # First spawn of a game has no next shape yet
+        first = games[~self.has_next_shape[games]]
+        if len(first) != 0:
+            self.next_shape[first] = self.draw_shapes(first)
+            self.has_next_shape[first] = True
+
+        self.shape_id[games] = self.next_shape[games]
+        self.next_shape[games] = self.draw_shapes(games)
+        self.rotation[games] = 0
+        self.row[games] = -1
+        self.col[games] = self.rng.integers(0, self.width - 3, size=len(games))
+        self.spawn_new[games] = False
+
+    def update(self, actions: Optional[np.ndarray] = None) -> None:
+        """
+        Advance every running game by one frame, same steps as Engine.update()
+        :param actions: int array with an action code for every game (NOOP, LEFT, RIGHT, ROTATE, DOWN, HARD_DROP)
+        """
+        alive = ~self.game_end
+
+        # 1. Actions, only for games that have a falling shape
+        if actions is not None:
+            has_shape = alive & ~self.spawn_new
+            self.manual_move(np.flatnonzero(has_shape & (actions == LEFT)), -1)
+            self.manual_move(np.flatnonzero(has_shape & (actions == RIGHT)), 1)
+            self.manual_rotate(np.flatnonzero(has_shape & (actions == ROTATE)))
+            self.move_down(np.flatnonzero(has_shape & (actions == DOWN)))
+            self.hard_drop(np.flatnonzero(has_shape & (actions == HARD_DROP)))
+
+        # 2. Tetris mode, rows only move on frames where frames & speed == 0 like in Engine.update()
+        # Games that move rows do nothing else this frame
+        collapsing = alive & (self.prev_tetris_row > 0) & ((self.frames & self.speed) == 0)
+        if collapsing.any():
+            games = np.flatnonzero(collapsing)
+            self.tetris_move(games)
+            self.prev_tetris_row[games] -= 1
+            # Check for cascading tetris
+            self.tetris(games[self.prev_tetris_row[games] == 0])
+            self.frames[games] += 1
+
+        running = alive & ~collapsing
+
+        # 3. Gravity
+        self.move_down(np.flatnonzero(running & ~self.spawn_new & (self.frames % self.speed == 0)))
+
+        # 4. Spawn or end the game
+        spawning = running & self.spawn_new & (self.prev_tetris_row == 0)
+        ended = spawning & np.any(self.boards[:, :2] != 0, axis=(1, 2))
+        self.game_end |= ended
+        self.spawn_shape(np.flatnonzero(spawning & ~ended))
+
+        self.frames[running & ~ended] += 1
+
+        if self.auto_reset and ended.any():
+            for game in np.flatnonzero(ended):
+                self.finished.append((int(self.score[game]), int(self.level[game]), int(self.total_tetris_rows[game]),
+                                      int(self.pieces_locked[game]), int(self.frames[game])))
+            self.reset(ended)
+
+    def step(self, frames: int = 1, actions: Optional[np.ndarray] = None) -> None:
+        """
+        Advance every running game by given amount of frames
+        :param frames: int
+        :param actions: int array of actions applied on the first frame
+        """
+        for _ in range(frames):
+            self.update(actions)
+            actions = None
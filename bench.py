@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from typing import Callable, Dict
+from engine import Engine
+
+"""
+Benchmarks for the Engine hot paths and end-to-end frame rate, results are written as JSON so
+they can be compared between versions
+
+Example:
+    python bench.py --output bench.json
+"""
+
+
+def fill_rows(engine: Engine, rng: random.Random, rows: int, full_rows: int = 0) -> None:
+    """
+    Fill bottom rows of the board with random cells
+    :param engine: Engine
+    :param rng: random generator of the fixture
+    :param rows: int, amount of bottom rows to fill, every row has at least one hole
+    :param full_rows: int, amount of bottom rows that are completely full (ready for tetris)
+    """
+    object_id = engine.pool.allocate(1, 0)
+    cells = 0
+    bottom = engine.height - 1
+    for row in range(bottom, bottom - rows, -1):
+        if row > bottom - full_rows:
+            holes = set()
+        else:
+            holes = set(rng.sample(range(engine.width), rng.randint(1, 3)))
+
+        for col in range(engine.width):
+            if col not in holes:
+                engine.set_cell(row, col, object_id)
+                cells += 1
+
+    engine.pool.cells_left[object_id] = cells
+
+
+def make_fixture(name: str, seed: int) -> Engine:
+    """
+    Seeded board fixtures, every fixture has a falling shape spawned
+    :param name: str, one of FIXTURES
+    :param seed: int
+    :return: Engine
+    """
+    rng = random.Random(seed)
+    engine = Engine(seed)
+    if name == "half_full":
+        fill_rows(engine, rng, 10)
+    elif name == "nearly_topped_out":
+        fill_rows(engine, rng, 17)
+    elif name == "multi_line_clear":
+        fill_rows(engine, rng, 8, full_rows=4)
+
+    engine.spawn_shape()
+    engine.spawn_new = False
+    # Start the shape below the spawn rows so it can rotate
+    engine.last_spawned_object_row = 0
+    return engine
+
+
+FIXTURES = ["empty", "half_full", "nearly_topped_out", "multi_line_clear"]
+
+
+def bench_tetris_move(engine: Engine) -> None:
+    engine.tetris()
+    while engine.prev_tetris_row > 0:
+        engine.tetris_move()
+        engine.prev_tetris_row -= 1
+
+
+# name: (function to time, calls per sample). Every sample runs on a fresh fixture
+BENCHMARKS: Dict[str, tuple] = {
+    "update": (lambda engine: engine.update(), 30),
+    "move": (lambda engine: engine.move(), 1),
+    "collision_detection_vertical": (lambda engine: engine.collision_detection_vertical(), 100),
+    "collision_detection_horizontal": (lambda engine: engine.collision_detection_horizontal("left"), 100),
+    "manual_rotate": (lambda engine: engine.manual_rotate(), 4),
+    "tetris": (lambda engine: engine.tetris(), 1),
+    "tetris+tetris_move": (bench_tetris_move, 1),
+    "spawn_shape": (lambda engine: engine.spawn_shape(), 1),
+}
+
+
+def time_function(function: Callable[[Engine], None], fixture: str, seed: int, calls: int, samples: int) -> dict:
+    # Fixture creation is not timed, only the calls
+    timings = []
+    for sample in range(samples):
+        engine = make_fixture(fixture, seed + sample)
+        start = time.perf_counter()
+        for _ in range(calls):
+            function(engine)
+        timings.append((time.perf_counter() - start) / calls)
+
+    return {
+        "calls": calls * samples,
+        "mean_ns": statistics.fmean(timings) * 1e9,
+        "median_ns": statistics.median(timings) * 1e9,
+        "min_ns": min(timings) * 1e9,
+    }
+
+
+def bench_headless_fps(seed: int, games: int) -> dict:
+    """
+    Play random games headless, once updating every frame and once with Engine.step skipping empty frames
+    :return: dict of frames per second
+    """
+    results = {}
+    for mode in ["update", "step"]:
+        frames = 0
+        start = time.perf_counter()
+        for game in range(games):
+            engine = Engine(seed + game)
+            rng = random.Random(seed + game)
+            while not engine.game_end:
+                engine.key_buffer.append(rng.choice(["left", "right", "rotate", "down"]))
+                if mode == "update":
+                    for _ in range(engine.speed):
+                        engine.update()
+                else:
+                    engine.step(engine.speed)
+
+            frames += engine.frames
+
+        results[mode] = {"frames": frames, "frames_per_sec": frames / (time.perf_counter() - start)}
+
+    return results
+
+
+# (width, height) of the boards in bench_board_sizes, frame cost should not grow with the area
+BOARD_SIZES = [(10, 20), (20, 40), (100, 200)]
+
+
+def bench_board_sizes(seed: int, frames: int) -> dict:
+    """
+    Update every frame of random games on bigger and bigger boards, a new game starts when one ends
+    :return: dict of ns per update for every board size
+    """
+    results = {}
+    for width, height in BOARD_SIZES:
+        rng = random.Random(seed)
+        engine = Engine(seed, width=width, height=height)
+        start = time.perf_counter()
+        for frame in range(frames):
+            if engine.game_end:
+                engine = Engine(seed + frame, width=width, height=height)
+            if engine.frames % 5 == 0:
+                engine.key_buffer.append(rng.choice(["left", "right", "rotate", "down", "hard_drop"]))
+            engine.update()
+
+        results[f"{width}x{height}"] = {"frames": frames, "ns_per_update": (time.perf_counter() - start) / frames * 1e9}
+
+    return results
+
+
+def bench_render(seed: int, frames: int) -> dict:
+    """
+    Time Render.draw_frame with SDL dummy video driver, no window or display needed
+    :return: dict of frame times, empty if pygame is not installed
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    try:
+        from main import Render
+    except ImportError:
+        return {}
+
+    engine = make_fixture("half_full", seed)
+    renderer = Render(engine)
+    timings = []
+    for _ in range(frames):
+        engine.update()
+        start = time.perf_counter()
+        renderer.draw_frame()
+        timings.append(time.perf_counter() - start)
+
+    renderer.cleanup()
+    return {
+        "frames": frames,
+        "mean_ms": statistics.fmean(timings) * 1e3,
+        "median_ms": statistics.median(timings) * 1e3,
+        "p99_ms": sorted(timings)[int(len(timings) * 0.99)] * 1e3,
+    }
+
+
+def run(seed: int, samples: int, games: int, render_frames: int) -> dict:
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.time(),
+        "seed": seed,
+        "hot_paths": {},
+    }
+
+    for name, (function, calls) in BENCHMARKS.items():
+        results["hot_paths"][name] = {}
+        for fixture in FIXTURES:
+            results["hot_paths"][name][fixture] = time_function(function, fixture, seed, calls, samples)
+
+    results["headless"] = bench_headless_fps(seed, games)
+    results["board_sizes"] = bench_board_sizes(seed, 20000)
+    results["render"] = bench_render(seed, render_frames)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark engine hot paths and frame rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=2000, help="fresh fixtures per hot path benchmark")
+    parser.add_argument("--games", type=int, default=50, help="games for headless frame rate")
+    parser.add_argument("--render-frames", type=int, default=300)
+    parser.add_argument("--output", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.seed, args.samples, args.games, args.render_frames)
+
+    for name, fixtures in results["hot_paths"].items():
+        timings = "  ".join(f"{fixture} {stats['median_ns']:.0f}ns" for fixture, stats in fixtures.items())
+        print(f"{name:>32}: {timings}")
+
+    for mode, stats in results["headless"].items():
+        print(f"{'headless ' + mode:>32}: {stats['frames_per_sec']:.0f} frames/sec")
+
+    for size, stats in results["board_sizes"].items():
+        print(f"{'update ' + size:>32}: {stats['ns_per_update']:.0f}ns")
+
+    if results["render"]:
+        print(f"{'render frame':>32}: median {results['render']['median_ms']:.2f}ms  "
+              f"p99 {results['render']['p99_ms']:.2f}ms")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
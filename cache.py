@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+"""
+Bounded least recently used cache, used by the bots to remember search and evaluation results
+keyed on Zobrist hashes of the positions.
+"""
+
+# Returned by get when the key is not in the cache, None can be a cached value
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, capacity: int = 65536):
+        """
+        :param capacity: int, most entries kept, least recently used one is dropped when full
+        """
+        if capacity < 1:
+            raise ValueError("capacity has to be at least 1")
+
+        self.capacity = capacity
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """
+        :param key: hashable key
+        :param default: returned when key is not cached
+        :return: cached value or default
+        """
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        # Does not count as a lookup and does not change the order
+        return key in self.entries
@@ -6,7 +6,8 @@ class Colors:
             "green": ("\033[1;30;48;5;46m", "\033[0m"),         # Green background, black foreground
             "yellow": ("\033[1;30;48;5;226m", "\033[0m"),       # Bright yellow background, black foreground
             "blue": ("\033[1;30;48;5;39m", "\033[0m"),          # Blue background, black foreground
-            "white": ("\033[1;30;107m", "\033[0m")         # Bright white background, black foreground
+            "white": ("\033[1;30;107m", "\033[0m"),        # Bright white background, black foreground
+            "gray": ("\033[1;30;48;5;245m", "\033[0m")     # Gray background, black foreground
         }
 
         self.square_to_color = {
@@ -0,0 +1,1065 @@
+from typing import List, Tuple, Optional, Callable, Set
+from array import array
+import random
+import struct
+import sys
+from time import perf_counter_ns
+from color import Colors
+from profiler import Profiler
+
+"""
+Headless game engine, has no pygame dependency so it can be simulated without display or audio device.
+Renderers read the state and get notified about events (sounds) through Engine.event_listener.
+"""
+
+
+# Default board size, Engine takes other sizes as width and height
+ROWS = 20
+COLS = 10
+
+# Shapes are max size 2x4
+ALL_SHAPES = [
+    [
+        [1, 1, 1, 0],
+        [0, 1, 0, 0]
+    ],
+    [
+        [1, 1, 1, 0],
+        [0, 0, 1, 0]
+    ],
+    [
+        [1, 1, 0, 0],
+        [0, 1, 1, 0]
+    ],
+    [
+        [1, 1, 0, 0],
+        [1, 1, 0, 0]
+    ],
+    [
+        [0, 1, 1, 0],
+        [1, 1, 0, 0]
+    ],
+    [
+        [1, 1, 1, 0],
+        [1, 0, 0, 0]
+    ],
+    [
+        [1, 1, 1, 1],
+        [0, 0, 0, 0]
+    ]
+]
+
+# Rotation box size for every shape, the shape is rotated around the center of the box
+ROTATION_BOX_SIZE = [3, 3, 3, 3, 3, 3, 4]
+
+# Offsets (row, col) tried in order when rotated shape does not fit in place
+KICKS = [
+    [(0, 0), (0, -1), (0, 1), (-1, 0)],
+    [(0, 0), (0, -1), (0, 1), (-1, 0)],
+    [(0, 0), (0, -1), (0, 1), (-1, 0)],
+    [(0, 0)],
+    [(0, 0), (0, -1), (0, 1), (-1, 0)],
+    [(0, 0), (0, -1), (0, 1), (-1, 0)],
+    [(0, 0), (0, -1), (0, 1), (0, -2), (0, 2), (-1, 0)]
+]
+
+
+def build_rotations(shape_id: int) -> List[Tuple[Tuple[int, int], ...]]:
+    """
+    Generate all 4 clockwise rotation states of the shape as (row, col) offsets from top left corner of
+    the rotation box. Spawned shape sits on the second row of the box, so the box starts one row above the spawn row
+    :param shape_id: int, index in ALL_SHAPES
+    :return: list of cell offsets for every rotation
+    """
+    shape = ALL_SHAPES[shape_id]
+    size = ROTATION_BOX_SIZE[shape_id]
+    cells = tuple((row + 1, col) for row in range(len(shape)) for col in range(len(shape[0])) if shape[row][col] != 0)
+
+    rotations = [cells]
+    for _ in range(3):
+        # Square looks the same in every rotation
+        if shape_id == 3:
+            rotations.append(cells)
+            continue
+
+        # (row, col) --> (col, size - 1 - row) is 90-degree clockwise rotation inside the box
+        cells = tuple(sorted((col, size - 1 - row) for row, col in cells))
+        rotations.append(cells)
+
+    return rotations
+
+
+def column_bottoms(cells: Tuple[Tuple[int, int], ...]) -> Tuple[Tuple[int, int], ...]:
+    # (col, lowest row) offset for every column the shape covers, used for finding the landing row
+    bottoms = {}
+    for d_row, d_col in cells:
+        bottoms[d_col] = max(bottoms.get(d_col, d_row), d_row)
+
+    return tuple(sorted(bottoms.items()))
+
+
+# Precomputed at startup: ROTATIONS[shape_id][rotation] = cell offsets
+ROTATIONS = [build_rotations(shape_id) for shape_id in range(len(ALL_SHAPES))]
+COLUMN_BOTTOMS = [[column_bottoms(cells) for cells in rotations] for rotations in ROTATIONS]
+
+# Falling shape box can be above and left of the board
+PIECE_MIN_ROW = -3
+PIECE_MIN_COL = -3
+
+
+class ZobristKeys:
+    """
+    Zobrist keys of one board size: random 64-bit number for every cell and for every falling shape position,
+    hash of a position is the XOR of the keys of what is in it. Seeded from the size so hashes are the same
+    in every process. Shape position key is the XOR of shape, row and col keys, so big boards don't need
+    a key for every shape in every cell
+    """
+
+    def __init__(self, rows: int, cols: int):
+        rng = random.Random(f"zobrist {rows}x{cols}")
+        self.cells = [[rng.getrandbits(64) for col in range(cols)] for row in range(rows)]
+        self.pieces = [[rng.getrandbits(64) for rotation in range(4)] for shape_id in range(len(ALL_SHAPES))]
+        self.piece_rows = [rng.getrandbits(64) for row in range(rows - PIECE_MIN_ROW)]
+        self.piece_cols = [rng.getrandbits(64) for col in range(cols - PIECE_MIN_COL)]
+
+    def row_hash(self, row: int, bits: int) -> int:
+        # XOR of the cell keys of the set bits
+        keys = self.cells[row]
+        hash_value = 0
+        while bits:
+            low_bit = bits & -bits
+            hash_value ^= keys[low_bit.bit_length() - 1]
+            bits ^= low_bit
+
+        return hash_value
+
+    def board_hash(self, board: List[int]) -> int:
+        """
+        Zobrist hash of the occupancy of a bitboard, same value as Engine.board_hash
+        :param board: list of row bits
+        :return: int
+        """
+        hash_value = 0
+        for row, bits in enumerate(board):
+            if bits:
+                hash_value ^= self.row_hash(row, bits)
+
+        return hash_value
+
+    def piece_key(self, shape_id: int, rotation: int, row: int, col: int) -> int:
+        # Zobrist key of the falling shape at the rotation box position
+        return (self.pieces[shape_id][rotation] ^ self.piece_rows[row - PIECE_MIN_ROW]
+                ^ self.piece_cols[col - PIECE_MIN_COL])
+
+
+_zobrist_keys = {}
+
+
+def zobrist_keys(rows: int = ROWS, cols: int = COLS) -> ZobristKeys:
+    # Keys are made once per board size and shared by every engine of that size
+    keys = _zobrist_keys.get((rows, cols))
+    if keys is None:
+        keys = _zobrist_keys[(rows, cols)] = ZobristKeys(rows, cols)
+
+    return keys
+
+
+# Every color a cell can have, pieces only store the index. Index 0 is used for empty cells
+PALETTE = ["blue", "white", "red", "green", "yellow", "orange", "gray"]
+# Palette indexes new shapes pick their color from
+SHAPE_COLORS = [1, 2, 3, 4, 5]
+# Garbage rows sent by opponents, no shape picks this color
+GARBAGE_COLOR = 6
+
+
+def iterate_bits(bits: int):
+    # Index of every set bit, lowest first
+    while bits:
+        low_bit = bits & -bits
+        yield low_bit.bit_length() - 1
+        bits ^= low_bit
+
+
+class PiecePool:
+    """
+    Bookkeeping of object ids: cells left on the board and palette color for every id.
+
+    Ids are handed out from a free list and given back when the last cell of the piece is cleared,
+    so they stay below capacity no matter how many pieces have been played. Id 0 means empty cell
+    and is never handed out.
+    """
+
+    def __init__(self, capacity: int = ROWS * COLS + 3):
+        """
+        :param capacity: int, amount of ids. Every board cell can be a different piece, plus falling and next shape
+        """
+        self.cells_left = array("H", [0]) * capacity
+        self.colors = array("B", [0]) * capacity
+        # Stack of unused ids, lowest id on top
+        self.free_ids = array("H", range(capacity - 1, 0, -1))
+
+    def allocate(self, color: int, cells: int = 4) -> int:
+        """
+        Take unused id for a new piece
+        :param color: int, index in PALETTE
+        :param cells: int, amount of cells the piece has on the board
+        :return: int, object id
+        """
+        if not self.free_ids:
+            # Every board cell, falling and next shape fit in the capacity, so running out means ids were leaked
+            raise RuntimeError(f"Piece pool ran out of its {len(self.colors) - 1} ids, cells were not removed")
+
+        object_id = self.free_ids.pop()
+        self.cells_left[object_id] = cells
+        self.colors[object_id] = color
+        return object_id
+
+    def remove_cells(self, object_id: int, count: int = 1) -> None:
+        """
+        Piece lost cells from the board, id is freed when it has none left
+        :param object_id: int
+        :param count: int, amount of cells removed
+        """
+        # Already freed (e.g. copied cells of top row), don't free it twice
+        if object_id == 0 or self.cells_left[object_id] == 0:
+            return
+
+        cells_left = max(0, self.cells_left[object_id] - count)
+        self.cells_left[object_id] = cells_left
+        if cells_left == 0:
+            self.free_ids.append(object_id)
+
+    def in_use(self) -> int:
+        # Amount of ids handed out and not freed yet
+        return len(self.colors) - 1 - len(self.free_ids)
+
+
+# Fixed part of Engine.snapshot(): seed, frames, speed, level, score, lines, pieces locked, flags, prev tetris row,
+# tetris bottom row, falling shape (id, shape, rotation, row, col), next shape, next id, prev color, bucket size,
+# board hash, pool capacity, free id count, height, width. Arrays follow it, all little endian
+SNAPSHOT_FIELDS = struct.Struct("<QIHHQIIBHhHBBhhbHBBQHHHH")
+RNG_GAUSS = struct.Struct("<?d")
+BIG_ENDIAN = sys.byteorder == "big"
+
+
+def array_bytes(values: array) -> bytes:
+    # Snapshots are little endian so they can be saved to files
+    if BIG_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    return values.tobytes()
+
+
+def bytes_array(typecode: str, data, offset: int, count: int) -> Tuple[array, int]:
+    """
+    Read little endian array from data
+    :return: (array, offset after it)
+    """
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if BIG_ENDIAN:
+        values.byteswap()
+
+    return values, end
+
+
+class Engine:
+    """
+    Game state:
+
+    Game will be a grid of height x width, 20x10 by default
+    New shapes will spawn in the first 2 rows in top
+    New shape is max size 2x4
+
+    Falling shape is not part of the state, it is tracked by shape id, rotation and the top left corner
+    of its rotation box. Cells are written to the state only when the shape locks
+
+    Update loop (in order):
+
+    1. If tetris mode: Keep only updating the falling pieces and return
+    2. Primary shape exists: Keep dropping the primary piece, also if tetris mode can happen
+    3. No primary shape: generate one
+
+    Score and level system:
+
+    Every 10 tetris cleared a new level will begin
+    Score is calculated based on this formula points_for_tetris_lines * (level + 1)
+    """
+
+    def __init__(self, seed: Optional[int] = None, record_inputs: bool = False, width: int = COLS,
+                 height: int = ROWS):
+        """
+        :param seed: int, seed for the random generator of this engine, same seed and inputs give the same game.
+                     0 to 2 ** 64 - 1, snapshots and replay files store it as 64-bit unsigned
+        :param record_inputs: bool, save every key_buffer batch with its frame number to input_log
+        :param width: int, amount of cols, at least 4 so every shape can spawn
+        :param height: int, amount of rows, at least 4
+        """
+        if width < 4 or height < 4:
+            raise ValueError("Board has to be at least 4x4")
+        # Object ids are 16-bit, every cell can hold a different piece
+        if width * height + 3 > 0xFFFF:
+            raise ValueError(f"Board {height}x{width} has too many cells")
+        if seed is not None and not (isinstance(seed, int) and 0 <= seed < 2 ** 64):
+            raise ValueError(f"Seed has to be an int from 0 to 2 ** 64 - 1, got {seed!r}")
+
+        self.width = width
+        self.height = height
+        self.full_row = (1 << width) - 1
+        self.zobrist = zobrist_keys(height, width)
+
+        # Pick the seed here when not given, so every game can be replayed
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.input_log: Optional[List[Tuple[int, Tuple[str, ...]]]] = [] if record_inputs else None
+
+        # Object id for every cell
+        self.state: List[List[int]] = []
+        # Occupancy of every row as bits, bit n is set when state[row][n] != 0
+        self.bitboard: List[int] = []
+        # Filled cells in every row and height of every column (0 = empty column, self.height = top row is taken)
+        self.row_counts: List[int] = []
+        self.heights: List[int] = [0] * width
+        # Rows that got full when cells were written, tetris() only has to look at these
+        self.full_rows: Set[int] = set()
+        # Zobrist hash of the occupancy, updated when cells are filled or emptied
+        self.board_hash = 0
+
+        self.init_state()
+        self.key_buffer = []
+        self.frames = 0
+
+        # Speed calculated from 16.6ms * self.speed --> lower the speed faster the update
+        self.speed = 30
+
+        # Shapes are max size 2x4
+        self.all_shapes = ALL_SHAPES
+        self.shape_bucket = self.make_bucket_sort()
+
+        self.game_end = False
+
+        # Falling shape, row and col are the top left corner of the rotation box (can be outside the grid)
+        self.last_spawned_object_id: Optional[int] = None
+        self.last_spawned_object_row: Optional[int] = None
+        self.last_spawned_object_col: Optional[int] = None
+        self.last_spawned_shape_id: Optional[int] = None  # Save the index based on all_shapes array
+        self.last_spawned_rotation: Optional[int] = None  # Index in ROTATIONS[last_spawned_shape_id]
+        self.prev_color: Optional[int] = None
+
+        # Next shape
+        self.next_shape = None
+        self.next_object_id = None
+
+        # Tetris memory
+        self.tetris_bottom_row = None
+        self.prev_tetris_row = 0
+        self.total_tetris_rows = 0
+
+        self.level = 0
+        self.score = 0
+
+        # Cells left and palette color for each object id, ids are recycled
+        self.pool = PiecePool(width * height + 3)
+
+        self.colorer = Colors()
+        self.spawn_new = True
+        self.pieces_locked = 0
+
+        # Called with event name ("tetris") when something renderer might care about happens, e.g. play sound
+        self.event_listener: Optional[Callable[[str], None]] = None
+        # Phase timings of update when set, None keeps profiling off
+        self.profiler: Optional[Profiler] = None
+
+    def init_state(self):
+        for row in range(self.height):
+            self.state.append([0] * self.width)
+            self.bitboard.append(0)
+            self.row_counts.append(0)
+
+    def set_cell(self, row: int, col: int, value: int) -> None:
+        # Every write to state has to go through here so bitboard, row counts and heights stay in sync
+        was_filled = self.state[row][col] != 0
+        self.state[row][col] = value
+        if value == 0:
+            if was_filled:
+                self.bitboard[row] &= ~(1 << col)
+                self.board_hash ^= self.zobrist.cells[row][col]
+                self.full_rows.discard(row)
+                self.row_counts[row] -= 1
+                if self.heights[col] == self.height - row:
+                    self.recompute_height(col)
+        elif not was_filled:
+            self.bitboard[row] |= 1 << col
+            self.board_hash ^= self.zobrist.cells[row][col]
+            self.row_counts[row] += 1
+            if self.row_counts[row] == self.width:
+                self.full_rows.add(row)
+            if self.heights[col] < self.height - row:
+                self.heights[col] = self.height - row
+
+    def position_hash(self) -> int:
+        """
+        Zobrist hash of the board and the falling shape
+        :return: int, same as board_hash when there is no falling shape
+        """
+        if self.last_spawned_object_id is None:
+            return self.board_hash
+
+        return self.board_hash ^ self.zobrist.piece_key(self.last_spawned_shape_id, self.last_spawned_rotation,
+                                                        self.last_spawned_object_row, self.last_spawned_object_col)
+
+    def recompute_height(self, col: int) -> None:
+        # Column got lower, walk down from the old top until next filled cell
+        col_bit = 1 << col
+        row = self.height - self.heights[col]
+        while row < self.height and not self.bitboard[row] & col_bit:
+            row += 1
+
+        self.heights[col] = self.height - row
+
+    def snapshot(self) -> bytes:
+        """
+        Pack the whole game state into bytes: counters, falling and next shape, bag, cells and the derived
+        bitboard, counts and heights, piece pool and random generator. Pending key_buffer is not included
+        :return: bytes for restore()
+        """
+        falling = self.last_spawned_object_id is not None
+        pool = self.pool
+        _, rng_state, gauss_next = self.rng.getstate()
+        return b"".join([
+            SNAPSHOT_FIELDS.pack(
+                self.seed, self.frames, self.speed, self.level, self.score, self.total_tetris_rows, self.pieces_locked,
+                self.game_end | self.spawn_new << 1, self.prev_tetris_row,
+                -1 if self.tetris_bottom_row is None else self.tetris_bottom_row,
+                self.last_spawned_object_id if falling else 0,
+                self.last_spawned_shape_id if falling else 0,
+                self.last_spawned_rotation if falling else 0,
+                self.last_spawned_object_row if falling else 0,
+                self.last_spawned_object_col if falling else 0,
+                -1 if self.next_shape is None else self.next_shape[0],
+                0 if self.next_object_id is None else self.next_object_id,
+                0 if self.prev_color is None else self.prev_color,
+                len(self.shape_bucket), self.board_hash, len(pool.colors), len(pool.free_ids), self.height, self.width,
+            ),
+            bytes([shape_id for shape_id, _ in self.shape_bucket]),
+            array_bytes(array("H", [cell for row in self.state for cell in row])),
+            # Rows can be wider than any array type, every row takes the bytes of the board width
+            b"".join([bits.to_bytes(self.row_bytes(), "little") for bits in self.bitboard]),
+            array_bytes(array("H", self.row_counts)),
+            array_bytes(array("H", self.heights)),
+            array_bytes(pool.cells_left),
+            bytes(pool.colors),
+            array_bytes(pool.free_ids),
+            array_bytes(array("I", rng_state)),
+            RNG_GAUSS.pack(gauss_next is not None, gauss_next or 0.0),
+        ])
+
+    def restore(self, data, offset: int = 0) -> None:
+        """
+        Go back to the state saved by snapshot(), key_buffer is emptied. input_log and event_listener stay
+        :param data: bytes like object from snapshot()
+        :param offset: int, where the snapshot starts in data
+        """
+        (self.seed, self.frames, self.speed, self.level, self.score, self.total_tetris_rows, self.pieces_locked,
+         flags, self.prev_tetris_row, tetris_bottom_row, object_id, shape_id, rotation, row, col, next_shape,
+         next_object_id, prev_color, bucket_size, self.board_hash, capacity, free_count, height,
+         width) = SNAPSHOT_FIELDS.unpack_from(data, offset)
+        offset += SNAPSHOT_FIELDS.size
+
+        # Snapshot can be of other board size than the engine had before
+        self.width = width
+        self.height = height
+        self.full_row = (1 << width) - 1
+        self.zobrist = zobrist_keys(height, width)
+
+        self.game_end = bool(flags & 1)
+        self.spawn_new = bool(flags & 2)
+        self.tetris_bottom_row = None if tetris_bottom_row == -1 else tetris_bottom_row
+        if object_id != 0:
+            self.last_spawned_object_id = object_id
+            self.last_spawned_shape_id = shape_id
+            self.last_spawned_rotation = rotation
+            self.last_spawned_object_row = row
+            self.last_spawned_object_col = col
+        else:
+            self.last_spawned_object_id = None
+            self.last_spawned_shape_id = None
+            self.last_spawned_rotation = None
+            self.last_spawned_object_row = None
+            self.last_spawned_object_col = None
+
+        if next_shape != -1:
+            self.next_shape = (next_shape, ALL_SHAPES[next_shape])
+            self.next_object_id = next_object_id
+        else:
+            self.next_shape = None
+            self.next_object_id = None
+
+        self.prev_color = None if prev_color == 0 else prev_color
+        self.shape_bucket = [(shape_id, ALL_SHAPES[shape_id]) for shape_id in data[offset:offset + bucket_size]]
+        offset += bucket_size
+
+        cells, offset = bytes_array("H", data, offset, height * width)
+        self.state = [cells[row * width:(row + 1) * width].tolist() for row in range(height)]
+        row_bytes = self.row_bytes()
+        self.bitboard = [int.from_bytes(data[start:start + row_bytes], "little")
+                         for start in range(offset, offset + height * row_bytes, row_bytes)]
+        offset += height * row_bytes
+        row_counts, offset = bytes_array("H", data, offset, height)
+        self.row_counts = row_counts.tolist()
+        heights, offset = bytes_array("H", data, offset, width)
+        self.heights = heights.tolist()
+        self.full_rows = {row for row in range(height) if self.row_counts[row] == width}
+
+        pool = PiecePool.__new__(PiecePool)
+        pool.cells_left, offset = bytes_array("H", data, offset, capacity)
+        pool.colors, offset = bytes_array("B", data, offset, capacity)
+        pool.free_ids, offset = bytes_array("H", data, offset, free_count)
+        self.pool = pool
+
+        rng_state, offset = bytes_array("I", data, offset, 625)
+        has_gauss, gauss_next = RNG_GAUSS.unpack_from(data, offset)
+        self.rng.setstate((3, tuple(rng_state), gauss_next if has_gauss else None))
+        self.key_buffer = []
+
+    def row_bytes(self) -> int:
+        # Bytes of one bitboard row in snapshots
+        return (self.width + 7) // 8
+
+    def clone(self) -> "Engine":
+        """
+        Independent copy of the game, changes to one don't affect the other
+        :return: Engine with the same state, no input_log or event_listener
+        """
+        engine = Engine.__new__(Engine)
+        engine.rng = random.Random(0)
+        engine.input_log = None
+        engine.event_listener = None
+        engine.profiler = None
+        engine.all_shapes = ALL_SHAPES
+        engine.colorer = self.colorer
+        engine.restore(self.snapshot())
+        return engine
+
+    def make_bucket_sort(self):
+        # Fill bucket with all 7 shapes
+        return [(shape_id, self.all_shapes[shape_id]) for shape_id in range(7)]
+
+    def random_color(self) -> int:
+        # Choose new random palette index that is not the same as previous
+        new_color = self.rng.choice(SHAPE_COLORS)
+        while new_color == self.prev_color:
+            new_color = self.rng.choice(SHAPE_COLORS)
+
+        self.prev_color = new_color
+        return new_color
+
+    def color_of(self, object_id: int) -> str:
+        # Color name of the object, id 0 gives the empty cell color
+        return PALETTE[self.pool.colors[object_id]]
+
+    def print_state(self):
+        # os.system("cls")
+        falling_cells = self.piece_cells()
+        for i, row in enumerate(self.state):
+            for j, cell in enumerate(row):
+                if (i, j) in falling_cells:
+                    cell = self.last_spawned_object_id
+                color = self.color_of(cell)
+                print(self.colorer.color_text(f" {cell} ", color), end="")
+            print("\n", end="")
+
+        print("\n")
+
+    def get_next_shape(self):
+        # If all shapes used, generate bucket again
+        if len(self.shape_bucket) == 0:
+            self.shape_bucket = self.make_bucket_sort()
+
+        # Choose random index based on amount of items in bucket
+        random_int = self.rng.randint(0, len(self.shape_bucket) - 1)
+        random_shape = self.shape_bucket[random_int]
+        self.shape_bucket.pop(random_int)
+
+        # Take free id for the shape, it is given back when all 4 cells are cleared
+        new_id = self.pool.allocate(self.random_color())
+
+        return random_shape, new_id
+
+    def spawn_shape(self):
+        # Check if next shape already exists, if not create it otherwise use it
+        # This is for showing the next falling object
+        if self.next_shape is not None:
+            random_choice = self.next_shape
+            current_object_id = self.next_object_id
+        elif self.next_shape is None:
+            random_choice, current_object_id = self.get_next_shape()
+        else:
+            raise ("New shape was not able to be generated")
+
+        self.next_shape, self.next_object_id = self.get_next_shape()
+        # Save id of the shape
+        self.last_spawned_shape_id = random_choice[0]
+
+        # Choose random col to spawn, rotation box starts one row above the grid. Widest shape takes 4 cols
+        random_col = self.rng.randint(0, self.width - 4)
+        self.last_spawned_object_row = -1
+        self.last_spawned_object_col = random_col
+        self.last_spawned_rotation = 0
+        self.last_spawned_object_id = current_object_id
+
+    def piece_cells(self) -> List[Tuple[int, int]]:
+        """
+        Cells of the falling shape
+        :return: list of (row, col), empty if there is no falling shape
+        """
+        if self.last_spawned_object_id is None:
+            return []
+
+        row, col = self.last_spawned_object_row, self.last_spawned_object_col
+        return [(row + d_row, col + d_col) for d_row, d_col in ROTATIONS[self.last_spawned_shape_id][self.last_spawned_rotation]]
+
+    def shape_fits(self, shape_id, rotation, box_row, box_col) -> bool:
+        """
+        Check whether shape in given rotation fits to the box position without hitting walls or other objects
+        :param shape_id: int
+        :param rotation: int
+        :param box_row: int, top row of the rotation box
+        :param box_col: int, left col of the rotation box
+        :return: bool, True if shape fits
+        """
+        for d_row, d_col in ROTATIONS[shape_id][rotation]:
+            row, col = box_row + d_row, box_col + d_col
+            if row < 0 or row >= self.height or col < 0 or col >= self.width:
+                return False
+
+            if self.bitboard[row] >> col & 1:
+                return False
+
+        return True
+
+    def collision_detection_vertical(self) -> bool:
+        """
+        Check if the falling shape would hit bottom or another object when moved one row down
+        :return: bool, True if collision happened
+        """
+        return not self.shape_fits(self.last_spawned_shape_id, self.last_spawned_rotation,
+                                   self.last_spawned_object_row + 1, self.last_spawned_object_col)
+
+    def collision_detection_horizontal(self, side: str) -> bool:
+        """
+        Check if the falling shape would hit wall or another object when moved one column to the side
+        :param side: str, which side to check for collision
+        :return: bool, True if collision happened
+        """
+        col_change = 1 if side == "right" else -1
+        return not self.shape_fits(self.last_spawned_shape_id, self.last_spawned_rotation,
+                                   self.last_spawned_object_row, self.last_spawned_object_col + col_change)
+
+    def lazy_game_end(self) -> bool:
+        # Only going to check that if there is piece in the top 2 rows when trying to spawn new game ends
+        return (self.bitboard[0] | self.bitboard[1]) != 0
+
+    def ghost_row(self) -> Optional[int]:
+        """
+        Find the row where falling shape lands if dropped straight down. Uses the column heights so the cost
+        depends on the shape width instead of the drop distance
+        :return: int, top row of the rotation box at landing position, None if there is no falling shape
+        """
+        if self.last_spawned_object_id is None:
+            return None
+
+        shape_id, rotation = self.last_spawned_shape_id, self.last_spawned_rotation
+        row, col = self.last_spawned_object_row, self.last_spawned_object_col
+
+        landing_row = self.height
+        for d_col, bottom in COLUMN_BOTTOMS[shape_id][rotation]:
+            landing_row = min(landing_row, self.height - 1 - self.heights[col + d_col] - bottom)
+
+        if landing_row >= row:
+            return landing_row
+
+        # Shape is below the top of some column (moved under an overhang), heights can not see the gap under it
+        while self.shape_fits(shape_id, rotation, row + 1, col):
+            row += 1
+
+        return row
+
+    def hard_drop(self) -> None:
+        # Drop falling shape to the landing row and lock it right away
+        if self.last_spawned_object_id is None:
+            return
+
+        self.last_spawned_object_row = self.ghost_row()
+        self.lock_piece()
+
+    def move(self) -> None:
+        # Move falling shape one row down, collision has to be checked before
+        self.last_spawned_object_row += 1
+
+    def manual_move(self, direction: str) -> None:
+        """
+        Move falling shape to given direction by one block
+        :param direction: Left or right
+        :return:
+        """
+        if self.last_spawned_object_id is None:
+            return
+
+        # Make certain object is not horizontally hitting something
+        if self.collision_detection_horizontal(direction):
+            return
+
+        if direction == "right":
+            self.last_spawned_object_col += 1
+        elif direction == "left":
+            self.last_spawned_object_col -= 1
+
+    def manual_rotate(self) -> None:
+        """
+        Rotates the falling shape clockwise. Rotation is a lookup from ROTATIONS, if the rotated shape
+        does not fit the KICKS offsets are tried in order
+        :return:
+        """
+        if self.last_spawned_object_id is None:
+            return
+
+        shape_id = self.last_spawned_shape_id
+        new_rotation = (self.last_spawned_rotation + 1) % 4
+
+        for kick_row, kick_col in KICKS[shape_id]:
+            new_row = self.last_spawned_object_row + kick_row
+            new_col = self.last_spawned_object_col + kick_col
+            if self.shape_fits(shape_id, new_rotation, new_row, new_col):
+                self.last_spawned_rotation = new_rotation
+                self.last_spawned_object_row = new_row
+                self.last_spawned_object_col = new_col
+                return
+
+    def tetris(self) -> None:
+        # Rows get full only when cells are written, so only the rows the locked shape touched are checked
+        if not self.full_rows:
+            return
+
+        tetris_count = 0
+
+        # Count destroyed recs for each object, top to bottom so tetris_bottom_row ends up the lowest row
+        for row in sorted(self.full_rows):
+            self.prev_tetris_row += 1
+            tetris_count += 1
+            self.tetris_bottom_row = row
+            for object_id in self.state[row]:
+                self.pool.remove_cells(object_id)
+
+            self.state[row] = [0] * self.width
+            self.board_hash ^= self.zobrist.row_hash(row, self.bitboard[row])
+            self.bitboard[row] = 0
+            self.row_counts[row] = 0
+
+        # Cleared rows were full, so only the columns with nothing above the highest cleared row got lower
+        top_cleared = min(self.full_rows)
+        self.full_rows.clear()
+        above = 0
+        for row in range(self.height - max(self.heights), top_cleared):
+            above |= self.bitboard[row]
+
+        for col in iterate_bits(self.full_row & ~above):
+            self.recompute_height(col)
+
+        self.total_tetris_rows += tetris_count
+        match tetris_count:
+            case 1:
+                self.score += 40 * (self.level + 1)
+            case 2:
+                self.score += 80 * (self.level + 1)
+            case 3:
+                self.score += 300 * (self.level + 1)
+            case 4:
+                self.score += 1200 * (self.level + 1)
+
+        # Update level
+        # Speed up the game with formula 30 - (level * 2) Meaning after 150 tetris aka lvl 15 reach max speed
+        self.level = self.total_tetris_rows // 10
+        self.speed = 30 - (self.level * 2)
+
+        if self.speed < 1:
+            self.speed = 1
+
+        # Totals are already updated, so listener can see how many rows this tetris cleared
+        if self.event_listener is not None:
+            self.event_listener("tetris")
+
+    def add_garbage(self, lines: int, hole_col: int) -> None:
+        """
+        Push the board up and fill the bottom rows with garbage from an opponent, every garbage row has the same hole.
+        Cells pushed over the top end the game. Has to be called between updates and not while rows are collapsing
+        (prev_tetris_row > 0). Match host calls it after the update that locked a shape, often the next shape has
+        already spawned on that update: a falling shape that no longer fits is pushed up, at most as many rows as
+        were added, and the game ends if it still does not fit
+        :param lines: int, amount of garbage rows
+        :param hole_col: int, empty col of the garbage rows
+        """
+        lines = min(lines, self.height)
+        if lines <= 0:
+            return
+
+        for row in range(lines):
+            if self.bitboard[row]:
+                self.game_end = True
+                for object_id in self.state[row]:
+                    self.pool.remove_cells(object_id)
+
+        # All garbage rows are one object, so they take one id no matter how many are sent
+        garbage_id = self.pool.allocate(GARBAGE_COLOR, lines * (self.width - 1))
+        garbage_row = [garbage_id] * self.width
+        garbage_row[hole_col] = 0
+
+        del self.state[:lines]
+        del self.bitboard[:lines]
+        del self.row_counts[:lines]
+        for _ in range(lines):
+            self.state.append(list(garbage_row))
+            self.bitboard.append(self.full_row & ~(1 << hole_col))
+            self.row_counts.append(self.width - 1)
+
+        self.full_rows = {row - lines for row in self.full_rows if row >= lines}
+        self.board_hash = self.zobrist.board_hash(self.bitboard)
+
+        for col in range(self.width):
+            height = self.heights[col]
+            if col == hole_col and height == 0:
+                continue
+
+            if height + lines > self.height:
+                # Top of the column was pushed out, find the new one
+                self.heights[col] = self.height
+                self.recompute_height(col)
+            else:
+                self.heights[col] = height + lines
+
+        # Falling shape goes up with the board if it does not fit anymore
+        if self.last_spawned_object_id is not None:
+            for _ in range(lines):
+                if self.shape_fits(self.last_spawned_shape_id, self.last_spawned_rotation,
+                                   self.last_spawned_object_row, self.last_spawned_object_col):
+                    break
+
+                self.last_spawned_object_row -= 1
+            else:
+                if not self.shape_fits(self.last_spawned_shape_id, self.last_spawned_rotation,
+                                       self.last_spawned_object_row, self.last_spawned_object_col):
+                    self.game_end = True
+
+    def tetris_move(self):
+        # Move every rectangle down to the bottom tetris line, top row stays as it is
+        bottom_row = self.tetris_bottom_row
+        # Rows above the highest column are empty and stay empty
+        first_row = max(1, self.height - max(self.heights))
+        row_hash = self.zobrist.row_hash
+        # Columns that have cells in the moving rows
+        moved = 0
+        for row in range(first_row, bottom_row + 1):
+            moved |= self.bitboard[row]
+            if self.bitboard[row] != self.bitboard[row - 1]:
+                self.board_hash ^= row_hash(row, self.bitboard[row]) ^ row_hash(row, self.bitboard[row - 1])
+
+        # Bottom row is overwritten by the row above, its cells are gone. Cleared rows are empty, but with split
+        # clears the rows between them reach the bottom row on later moves
+        for object_id in self.state[bottom_row]:
+            self.pool.remove_cells(object_id)
+
+        self.state[1:bottom_row + 1] = self.state[0:bottom_row]
+        self.bitboard[1:bottom_row + 1] = self.bitboard[0:bottom_row]
+        self.row_counts[1:bottom_row + 1] = self.row_counts[0:bottom_row]
+        # Top row list is now in the state twice, has to copy otherwise python will mess up with references
+        self.state[0] = self.state[0].copy()
+
+        # Moving rows keeps the counts, cascading tetris is found from them without scanning the state
+        for row in range(first_row, bottom_row + 1):
+            if self.row_counts[row] == self.width:
+                self.full_rows.add(row)
+
+        # Columns with top inside the moved rows got one lower, top row is copied so it stays where it is.
+        # Columns with a cell on the top row or nothing down to the bottom row are not touched
+        for col in iterate_bits(moved & ~self.bitboard[0]):
+            top_row = self.height - self.heights[col]
+            if 0 < top_row < bottom_row:
+                self.heights[col] -= 1
+            elif top_row == bottom_row:
+                # Top cell got overwritten by the row above
+                self.recompute_height(col)
+
+    def lock_piece(self) -> None:
+        # Falling object hit something, write it to the state, check for tetris and spawn new one on next update
+        for row, col in self.piece_cells():
+            self.set_cell(row, col, self.last_spawned_object_id)
+
+        self.last_spawned_object_id = None
+        self.last_spawned_object_row = None
+        self.last_spawned_object_col = None
+        self.last_spawned_shape_id = None
+        self.last_spawned_rotation = None
+
+        if self.profiler is not None:
+            start = perf_counter_ns()
+            self.tetris()
+            self.profiler.add("engine.tetris", perf_counter_ns() - start)
+        else:
+            self.tetris()
+
+        self.spawn_new = True
+        self.pieces_locked += 1
+
+    def update(self):
+        """
+        Steps to happen
+        1. Loop until tetris over update all object to fall
+        2. Move primary object if exists
+        3. Spawn new primary object if not exists
+        :return:
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            # Phases nest: keys include locks done by keys, lock includes tetris
+            update_start = start = perf_counter_ns()
+
+        if self.input_log is not None and self.key_buffer:
+            self.input_log.append((self.frames, tuple(self.key_buffer)))
+
+        # Run all the key_events
+        for event in self.key_buffer:
+            # Make certain the primary object exists
+            if self.spawn_new is True:
+                break
+
+            if event == "left":
+                self.manual_move("left")
+            elif event == "right":
+                self.manual_move("right")
+            elif event == "rotate":
+                self.manual_rotate()
+            elif event == "hard_drop":
+                self.hard_drop()
+            elif event == "down":
+                collision_bool = self.collision_detection_vertical()
+
+                # If no collision move down
+                if not collision_bool:
+                    self.move()
+                # If collided object was last spawned, spawn new one
+                else:
+                    self.lock_piece()
+
+        if profiler is not None and self.key_buffer:
+            now = perf_counter_ns()
+            profiler.add("engine.keys", now - start)
+            start = now
+
+        self.key_buffer = []
+
+        # Use prev_tetris count to know how many updates to skip for falling tetris parts
+        if self.prev_tetris_row > 0 and self.frames & self.speed == 0:
+            self.tetris_move()
+            self.prev_tetris_row -= 1
+            # Check for cascading tetris
+            if self.prev_tetris_row == 0:
+                self.tetris_bottom_row = None
+                self.tetris()
+
+            self.frames += 1
+            if profiler is not None:
+                now = perf_counter_ns()
+                profiler.add("engine.tetris_move", now - start)
+                profiler.add("engine.update", now - update_start)
+            return
+
+        # Move primary down
+        if self.spawn_new is False and self.frames % self.speed == 0:
+            collision_bool = self.collision_detection_vertical()
+            if profiler is not None:
+                now = perf_counter_ns()
+                profiler.add("engine.collision", now - start)
+                start = now
+
+            # If no collision move down
+            if not collision_bool:
+                self.move()
+                phase = "engine.move"
+            # If collided object was last spawned, spawn new one
+            else:
+                self.lock_piece()
+                phase = "engine.lock"
+
+            if profiler is not None:
+                now = perf_counter_ns()
+                profiler.add(phase, now - start)
+                start = now
+
+        # Spawn a new shape
+        if self.spawn_new is True and self.prev_tetris_row == 0:
+            if self.lazy_game_end():
+                self.game_end = True
+                return
+
+            self.spawn_shape()
+            self.spawn_new = False
+            if profiler is not None:
+                now = perf_counter_ns()
+                profiler.add("engine.spawn", now - start)
+
+        self.frames += 1
+        if profiler is not None:
+            profiler.add("engine.update", perf_counter_ns() - update_start)
+
+    def next_event_frame(self) -> int:
+        """
+        Find the next frame where update can change the game, every frame before it only increases the frame counter
+        :return: int, frame number
+        """
+        if self.key_buffer or self.spawn_new or self.prev_tetris_row > 0:
+            return self.frames
+
+        # Only gravity left, it happens every self.speed frames
+        return self.frames + (-self.frames % self.speed)
+
+    def step(self, frames: int = 1) -> int:
+        """
+        Advance the game by given amount of frames. Frames where nothing happens are skipped instead of updated
+        :param frames: int, amount of frames to advance
+        :return: int, amount of frames advanced, less than asked if game ended
+        """
+        start_frame = self.frames
+        target_frame = self.frames + frames
+
+        while self.frames < target_frame and not self.game_end:
+            next_frame = self.next_event_frame()
+            if next_frame >= target_frame:
+                self.frames = target_frame
+                break
+
+            self.frames = next_frame
+            self.update()
+
+        return self.frames - start_frame
+
+    def step_until_lock(self, max_frames: Optional[int] = None) -> int:
+        """
+        Advance the game until the falling shape locks into place or game ends
+        :param max_frames: int, stop after this many frames even if nothing locked
+        :return: int, amount of frames advanced
+        """
+        start_frame = self.frames
+        pieces_locked = self.pieces_locked
+
+        while self.pieces_locked == pieces_locked and not self.game_end:
+            next_frame = self.next_event_frame()
+            if max_frames is not None and next_frame - start_frame >= max_frames:
+                self.frames = start_frame + max_frames
+                break
+
+            self.frames = next_frame
+            self.update()
+
+        return self.frames - start_frame
@@ -0,0 +1,320 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from engine import Engine, ROTATIONS, ROWS, COLS
+from batch import LEFT, RIGHT, ROTATE, DOWN, HARD_DROP
+from search import Placement, search_engine
+
+"""
+Reinforcement learning environment over the headless Engine with the Gym reset/step interface.
+
+Observations are NumPy arrays owned by the environment and updated in place, the observation dict holds
+read-only views of them and is the same object after every step (copy the arrays to keep an old observation):
+
+    board       (height, width) uint8, 1 for every filled cell, falling shape is not included
+    piece       (4,) int16, falling shape id, rotation, row and col of the rotation box, -1 when there is none
+    next_shape  (1,) int8, shape id of the next shape
+    stats       (3,) int64, score, level and cleared rows
+    action_mask (4 * width,) bool, placement actions that can be taken (placement mode only)
+
+Only the board rows whose bits changed in Engine.bitboard are written, so a step that moves the falling shape
+writes nothing. VecTetrisEnv keeps the arrays of many environments stacked, the arrays of every environment
+are views into them.
+
+Action modes:
+    primitive   action is one of the batch.py action codes (NOOP, LEFT, RIGHT, ROTATE, DOWN, HARD_DROP),
+                the key is pressed and the engine advances frames_per_step frames
+    placement   action is rotation * width + leftmost col of the shape, the shape is moved there and dropped,
+                the engine advances until the next shape has spawned. Actions not in action_mask only drop
+                the shape where it is
+
+Reward is the score gained on the step.
+
+Example:
+    env = TetrisEnv(mode="placement", seed=0)
+    observation, info = env.reset()
+    while True:
+        action = np.flatnonzero(observation["action_mask"])[0]
+        observation, reward, terminated, truncated, info = env.step(action)
+        if terminated or truncated:
+            break
+"""
+
+PRIMITIVE = "primitive"
+PLACEMENT = "placement"
+
+# Key for every primitive action code
+ACTION_KEYS: List[Optional[str]] = [None] * 6
+ACTION_KEYS[LEFT] = "left"
+ACTION_KEYS[RIGHT] = "right"
+ACTION_KEYS[ROTATE] = "rotate"
+ACTION_KEYS[DOWN] = "down"
+ACTION_KEYS[HARD_DROP] = "hard_drop"
+
+# Piece observation when there is no falling shape
+NO_PIECE = (-1, -1, -1, -1)
+
+# LEFT_COLS[shape_id][rotation] = col of the leftmost cell in the rotation box
+LEFT_COLS = [[min(d_col for _, d_col in cells) for cells in rotations] for rotations in ROTATIONS]
+
+# Widest board that gets a lookup table for row bits, the table has 2 ** width rows
+MAX_TABLE_WIDTH = 16
+_row_tables: Dict[int, np.ndarray] = {}
+
+
+def row_table(width: int) -> np.ndarray:
+    """
+    Cells of every possible row, row_table(width)[bits] is the board row of Engine.bitboard row bits
+    :param width: int, at most MAX_TABLE_WIDTH
+    :return: (2 ** width, width) uint8 array
+    """
+    table = _row_tables.get(width)
+    if table is None:
+        bits = np.arange(1 << width, dtype="<u4").view(np.uint8).reshape(-1, 4)
+        table = _row_tables[width] = np.unpackbits(bits, axis=1, bitorder="little")[:, :width].copy()
+
+    return table
+
+
+class TetrisEnv:
+    def __init__(self, mode: str = PRIMITIVE, seed: int = 0, width: int = COLS, height: int = ROWS,
+                 frames_per_step: int = 1, max_frames: Optional[int] = None, seed_step: int = 1,
+                 buffers: Optional[Tuple[np.ndarray, ...]] = None):
+        """
+        :param mode: str, PRIMITIVE or PLACEMENT
+        :param seed: int, engine seed of the first episode
+        :param width: int, board width
+        :param height: int, board height
+        :param frames_per_step: int, frames advanced by a primitive step, idle frames are skipped by Engine.step
+        :param max_frames: int, episode is truncated at this frame
+        :param seed_step: int, added to the seed for every new episode that is not given a seed
+        :param buffers: (board, piece, next shape, stats, action mask) arrays to write the observation to,
+                        VecTetrisEnv gives slices of its arrays. New arrays are made when not given
+        """
+        if mode not in (PRIMITIVE, PLACEMENT):
+            raise ValueError(f"Unknown mode {mode}, use {PRIMITIVE} or {PLACEMENT}")
+
+        self.mode = mode
+        self.width = width
+        self.height = height
+        self.frames_per_step = frames_per_step
+        self.max_frames = max_frames
+        self.next_seed = seed
+        self.seed_step = seed_step
+        self.action_count = len(ACTION_KEYS) if mode == PRIMITIVE else 4 * width
+
+        if buffers is None:
+            buffers = (np.zeros((height, width), dtype=np.uint8), np.zeros(4, dtype=np.int16),
+                       np.zeros(1, dtype=np.int8), np.zeros(3, dtype=np.int64),
+                       np.zeros(4 * width, dtype=bool))
+        self.board, self.piece, self.next_shape, self.stats, self.action_mask = buffers
+
+        self.observation: Dict[str, np.ndarray] = {
+            "board": self.board,
+            "piece": self.piece,
+            "next_shape": self.next_shape,
+            "stats": self.stats,
+        }
+        if mode == PLACEMENT:
+            self.observation["action_mask"] = self.action_mask
+
+        for name, array in list(self.observation.items()):
+            view = array.view()
+            view.flags.writeable = False
+            self.observation[name] = view
+
+        self.table = row_table(width) if width <= MAX_TABLE_WIDTH else None
+        self.row_bytes = (width + 7) // 8
+
+        self.engine: Optional[Engine] = None
+        # Board rows and falling shape the observation was written from
+        self.bits: List[int] = [0] * height
+        self.piece_key: Optional[tuple] = None
+        self.spawn_key: Optional[tuple] = None
+        self.score = 0
+        # Placement for every valid placement action of the falling shape
+        self.placements: Dict[int, Placement] = {}
+
+    def reset(self, seed: Optional[int] = None) -> Tuple[Dict[str, np.ndarray], dict]:
+        """
+        Start a new episode, it starts with the first shape spawned
+        :param seed: int, engine seed, by default the next seed of this env
+        :return: (observation, info)
+        """
+        if seed is None:
+            seed = self.next_seed
+            self.next_seed += self.seed_step
+
+        self.engine = Engine(seed, width=self.width, height=self.height)
+        self.engine.step(1)
+
+        self.board.fill(0)
+        self.bits = [0] * self.height
+        self.piece_key = None
+        self.spawn_key = None
+        # Stats are written on the first sync
+        self.score = -1
+        self.sync()
+        return self.observation, self.info()
+
+    def info(self) -> dict:
+        engine = self.engine
+        return {"seed": engine.seed, "frames": engine.frames, "pieces": engine.pieces_locked,
+                "lines": engine.total_tetris_rows}
+
+    def sync(self) -> None:
+        # Write what changed in the engine since the last sync to the observation arrays
+        engine = self.engine
+        bitboard = engine.bitboard
+        if bitboard != self.bits:
+            bits = self.bits
+            for row in range(self.height):
+                row_bits = bitboard[row]
+                if row_bits != bits[row]:
+                    bits[row] = row_bits
+                    if self.table is not None:
+                        self.board[row] = self.table[row_bits]
+                    else:
+                        row_data = np.frombuffer(row_bits.to_bytes(self.row_bytes, "little"), dtype=np.uint8)
+                        self.board[row] = np.unpackbits(row_data, bitorder="little")[:self.width]
+
+        if engine.last_spawned_object_id is None:
+            piece_key = NO_PIECE
+        else:
+            piece_key = (engine.last_spawned_shape_id, engine.last_spawned_rotation, engine.last_spawned_object_row,
+                         engine.last_spawned_object_col)
+
+        if piece_key != self.piece_key:
+            self.piece_key = piece_key
+            self.piece[:] = piece_key
+
+        # Every shape after the first spawns after a lock, sometimes on the same update and to the same place
+        spawn_key = (engine.pieces_locked, piece_key == NO_PIECE)
+        if spawn_key != self.spawn_key:
+            self.spawn_key = spawn_key
+            self.next_shape[0] = engine.next_shape[0]
+            if self.mode == PLACEMENT:
+                self.find_placements()
+
+        if engine.score != self.score:
+            self.score = engine.score
+            self.stats[:] = (engine.score, engine.level, engine.total_tetris_rows)
+
+    def find_placements(self) -> None:
+        self.placements = {}
+        for placement in search_engine(self.engine):
+            action = placement.rotation * self.width + placement.col + LEFT_COLS[placement.shape_id][placement.rotation]
+            # Search is breadth first, first placement of an action has the fewest keys
+            if action not in self.placements:
+                self.placements[action] = placement
+
+        self.action_mask.fill(False)
+        if self.placements:
+            self.action_mask[list(self.placements)] = True
+
+    def advance(self, action: int) -> int:
+        """
+        Take the action without building the step result
+        :param action: int
+        :return: int, reward
+        """
+        engine = self.engine
+        score = engine.score
+        if self.mode == PRIMITIVE:
+            key = ACTION_KEYS[action]
+            if key is not None:
+                engine.key_buffer.append(key)
+
+            engine.step(self.frames_per_step)
+        else:
+            placement = self.placements.get(action)
+            if placement is not None:
+                engine.key_buffer.extend(placement.keys())
+
+            engine.key_buffer.append("hard_drop")
+            engine.step(1)
+            # Rows collapse and the next shape spawns on the frames after the lock
+            while engine.spawn_new and not engine.game_end:
+                engine.step(1)
+
+        self.sync()
+        return engine.score - score
+
+    def truncated(self) -> bool:
+        return self.max_frames is not None and not self.engine.game_end and self.engine.frames >= self.max_frames
+
+    def step(self, action: int) -> Tuple[Dict[str, np.ndarray], int, bool, bool, dict]:
+        """
+        :param action: int, primitive action code or placement action
+        :return: (observation, reward, terminated, truncated, info)
+        """
+        reward = self.advance(action)
+        return self.observation, reward, self.engine.game_end, self.truncated(), self.info()
+
+
+class VecTetrisEnv:
+    """
+    Many TetrisEnv stepped together. Observations are stacked arrays with the environment as the first axis,
+    every environment writes its own slice. Environments that end are reset right away, the info of the
+    ended episode is in info["final_info"]
+    """
+
+    def __init__(self, count: int, mode: str = PRIMITIVE, seed: int = 0, width: int = COLS, height: int = ROWS,
+                 frames_per_step: int = 1, max_frames: Optional[int] = None):
+        """
+        :param count: int, amount of environments
+        :param seed: int, environment n starts from seed + n, its later episodes add count to the seed
+        """
+        self.count = count
+        self.boards = np.zeros((count, height, width), dtype=np.uint8)
+        self.pieces = np.zeros((count, 4), dtype=np.int16)
+        self.next_shapes = np.zeros((count, 1), dtype=np.int8)
+        self.stats = np.zeros((count, 3), dtype=np.int64)
+        self.action_masks = np.zeros((count, 4 * width), dtype=bool)
+
+        self.envs = [TetrisEnv(mode, seed + index, width, height, frames_per_step, max_frames, count,
+                               (self.boards[index], self.pieces[index], self.next_shapes[index], self.stats[index],
+                                self.action_masks[index]))
+                     for index in range(count)]
+        self.action_count = self.envs[0].action_count
+
+        self.observation: Dict[str, np.ndarray] = {}
+        for name, array in [("board", self.boards), ("piece", self.pieces), ("next_shape", self.next_shapes),
+                            ("stats", self.stats), ("action_mask", self.action_masks)]:
+            if name in self.envs[0].observation:
+                view = array.view()
+                view.flags.writeable = False
+                self.observation[name] = view
+
+    def reset(self, seed: Optional[int] = None) -> Tuple[Dict[str, np.ndarray], dict]:
+        """
+        :param seed: int, environment n starts from seed + n, by default every environment takes its next seed
+        :return: (observation, info)
+        """
+        for index, env in enumerate(self.envs):
+            env.reset(None if seed is None else seed + index)
+
+        return self.observation, {}
+
+    def step(self, actions) -> Tuple[Dict[str, np.ndarray], np.ndarray, np.ndarray, np.ndarray, dict]:
+        """
+        :param actions: one action for every environment
+        :return: (observation, rewards, terminated, truncated, info)
+        """
+        if isinstance(actions, np.ndarray):
+            actions = actions.tolist()
+
+        rewards = [0] * self.count
+        terminated = [False] * self.count
+        truncated = [False] * self.count
+        final_info = {}
+        for index, env in enumerate(self.envs):
+            rewards[index] = env.advance(actions[index])
+            if env.engine.game_end or env.truncated():
+                terminated[index] = env.engine.game_end
+                truncated[index] = not terminated[index]
+                final_info[index] = env.info()
+                env.reset()
+
+        info = {"final_info": final_info} if final_info else {}
+        return (self.observation, np.array(rewards, dtype=np.int64), np.array(terminated), np.array(truncated),
+                info)
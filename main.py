@@ -1,8 +1,11 @@
+import os
 import pygame
-from typing import List, Tuple, Optional
-import random
 import time
-from color import Colors
+from time import perf_counter_ns
+from typing import List, Optional, Tuple
+from engine import Engine, PALETTE
+from profiler import Profiler
+from timestep import FixedTimestep, SimulationThread
 
 """
 Game area: Leave two rows to top for generation of cubes, 20x10 area,
@@ -10,17 +13,65 @@ Game area: Leave two rows to top for generation of cubes, 20x10 area,
 """
 
 
-# TODO: bug in engine when placing moved/rotated shapes and moving the 0 in shape down it will sometimes override other shapes
-# TODO: also it happens when moving sideways and collision does check horizontal but it overrides things top and below
-
 class Sound:
-    def __init__(self, volume=0.2):
+    """
+    Music is streamed with pygame.mixer.music. Sound effects are decoded once at startup and played from
+    a fixed pool of reserved mixer channels, so playing them never touches the disk in the game loop
+    """
+
+    def __init__(self, volume=0.2, channels=4, coalesce_time=0.05):
+        """
+        :param volume: float, music volume
+        :param channels: int, amount of mixer channels for effects, effects are dropped when all are busy
+        :param coalesce_time: float, same effect started again within this many seconds is merged into the first
+        """
         pygame.mixer.init()
         pygame.mixer.music.set_volume(volume)
         self.soundtrack_dict = {
             "main": "soundtracks/1 - Music 1.mp3",
             "move": "soundtracks/SFX 4.mp3"
         }
+        self.effect_dict = {
+            "move": "soundtracks/SFX 4.mp3",
+            "tetris": "soundtracks/SFX 10.mp3"
+        }
+
+        # Decode every effect once
+        self.effects = {name: pygame.mixer.Sound(path) for name, path in self.effect_dict.items()}
+
+        # Reserve channels so pygame does not give them to anything else
+        if pygame.mixer.get_num_channels() < channels:
+            pygame.mixer.set_num_channels(channels)
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(channels)]
+        self.next_channel = 0
+
+        self.coalesce_time = coalesce_time
+        self.last_played = {}
+        self.dropped = 0
+
+    def play_effect(self, name: str) -> bool:
+        """
+        Play preloaded effect on a free channel of the pool
+        :param name: str, key in effect_dict
+        :return: bool, False if effect was coalesced or dropped
+        """
+        now = time.perf_counter()
+        if now - self.last_played.get(name, -self.coalesce_time) < self.coalesce_time:
+            return False
+
+        # Round robin over the pool starting after the last used channel
+        for i in range(len(self.channels)):
+            index = (self.next_channel + i) % len(self.channels)
+            channel = self.channels[index]
+            if not channel.get_busy():
+                channel.play(self.effects[name])
+                self.next_channel = index + 1
+                self.last_played[name] = now
+                return True
+
+        self.dropped += 1
+        return False
 
     def load(self, track):
         pygame.mixer.music.load(self.soundtrack_dict[track])
@@ -44,14 +95,41 @@ class Sound:
         pygame.mixer.music.stop()
 
 
+class TextCache:
+    """
+    Keeps the last rendered surface for every label, font.render only runs when the text of the label changes
+    """
+
+    def __init__(self, font: pygame.font.Font, color=(255, 255, 255)):
+        self.font = font
+        self.color = color
+        self.labels = {}
+
+    def render(self, label: str, text: str) -> Tuple[pygame.Surface, bool]:
+        """
+        :param label: str, name of the label e.g. "score"
+        :param text: str, current text of the label
+        :return: (surface, changed) changed is True if the text was different from the last call
+        """
+        cached = self.labels.get(label)
+        if cached is not None and cached[0] == text:
+            return cached[1], False
+
+        surface = self.font.render(text, True, self.color)
+        self.labels[label] = (text, surface)
+        return surface, True
+
+
 class Render:
-    def __init__(self, engine, enable_sound=False):
+    def __init__(self, engine, enable_sound=False, fps_refresh=0.25, max_fps=60, threaded=False,
+                 profiler: Optional[Profiler] = None):
         pygame.init()
 
         # Sound stuff
         self.enable_sound = enable_sound
-        self.main_track = Sound()
-        self.main_track.load("main")
+        if self.enable_sound:
+            self.sound = Sound()
+            self.sound.load("main")
 
         self.SCREEN_WIDTH = 800
         self.SCREEN_HEIGHT = 800
@@ -61,9 +139,48 @@ class Render:
         self.clock = pygame.time.Clock()
         # Create a font object for rendering the FPS
         self.font = pygame.font.SysFont(None, 50)
-
-        # Game engine
+        self.text_cache = TextCache(self.font)
+        # Seconds between FPS text updates
+        self.fps_refresh = fps_refresh
+        self.fps_updated = 0.0
+        # Phase timings of the engine and this loop, None when profiling is off. F3 switches it on and off
+        self.profiler = profiler
+        self.profile_font = pygame.font.SysFont(None, 20)
+        self.profile_cache = TextCache(self.profile_font)
+        self.prev_profile: Optional[List[str]] = None
+
+        # Screen regions redrawn separately
+        self.next_box = (580, 320, 150, 150)
+        self.next_shape_rect = pygame.Rect(590, 370, 130, 90)
+        self.fps_rect = pygame.Rect(0, 0, 245, 50)
+        self.profile_rect = pygame.Rect(0, 50, 245, 400)
+        self.scores_rect = pygame.Rect(self.SCREEN_WIDTH - 150, 0, 150, 100)
+        # Board fits in 300x600 pixels, cells get smaller on big boards
+        self.cell_size = max(1, min(300 // engine.width, 600 // engine.height))
+        self.board_rect = pygame.Rect(250, 100, engine.width * self.cell_size, engine.height * self.cell_size)
+
+        # What is currently on the screen, only the differences are drawn every frame
+        self.background: Optional[pygame.Surface] = None
+        self.dirty_rects: List[pygame.Rect] = []
+        self.prev_cells: Optional[List[Optional[str]]] = None
+        self.prev_next = None
+        self.prev_scores = None
+        self.draw_background()
+
+        # Game engine, runs on fixed timestep independent of the draw rate. Drawing reads self.view, which is
+        # the engine itself or in threaded mode the newest snapshot of it
         self.engine: Engine = engine
+        self.engine.event_listener = self.handle_engine_event
+        self.engine.profiler = profiler
+        self.view: Engine = engine
+        # 0 means draw as fast as possible
+        self.max_fps = max_fps
+        self.threaded = threaded
+        if self.threaded:
+            self.simulation = SimulationThread(engine)
+        else:
+            self.timestep = FixedTimestep(engine)
+        self.profile_output = profiler.output if profiler is not None else None
         self.timer = 0
         self.move_timer = 0
         # List for squares
@@ -74,55 +191,116 @@ class Render:
             if event.type == pygame.QUIT:
                 self.run = False
                 self.engine.game_end = True
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.toggle_profiler()
+
+    def toggle_profiler(self) -> None:
+        # New profiler starts with empty windows, export file of the old one is kept
+        if self.profiler is None:
+            self.profiler = Profiler(output=self.profile_output)
+        else:
+            self.profile_output = self.profiler.output
+            self.profiler = None
+            self.prev_profile = None
+            self.clear_region(self.profile_rect)
+
+        # Engine of the simulation thread reads the attribute on its next update
+        self.engine.profiler = self.profiler
 
     def handle_keys(self) -> None:
         key = pygame.key.get_pressed()
 
         if key[pygame.K_LEFT] and self.move_timer <= 0:
             if self.enable_sound:
-                pygame.mixer.Sound("soundtracks/SFX 4.mp3").play()
-            self.engine.key_buffer.append("left")
+                self.sound.play_effect("move")
+            self.send_key("left")
             self.move_timer = 0.15
         elif key[pygame.K_RIGHT] and self.move_timer <= 0:
             if self.enable_sound:
-                pygame.mixer.Sound("soundtracks/SFX 4.mp3").play()
-            self.engine.key_buffer.append("right")
+                self.sound.play_effect("move")
+            self.send_key("right")
             self.move_timer = 0.15
         elif key[pygame.K_UP] and self.move_timer <= 0:
             if self.enable_sound:
-                pygame.mixer.Sound("soundtracks/SFX 4.mp3").play()
-            self.engine.key_buffer.append("rotate")
+                self.sound.play_effect("move")
+            self.send_key("rotate")
             self.move_timer = 0.15
         elif key[pygame.K_DOWN] and self.move_timer <= 0:
-            self.engine.key_buffer.append("down")
+            self.send_key("down")
+            self.move_timer = 0.15
+        elif key[pygame.K_SPACE] and self.move_timer <= 0:
+            self.send_key("hard_drop")
             self.move_timer = 0.15
 
-    def handle_fps(self):
-        # Calculate and display FPS
+    def send_key(self, key: str):
+        if self.threaded:
+            self.simulation.send_keys(key)
+        else:
+            self.engine.key_buffer.append(key)
+
+    def handle_engine_event(self, event: str):
+        # Engine is headless, so sounds for the game events are played here
+        if event == "tetris" and self.enable_sound:
+            self.sound.play_effect("tetris")
+
+    def handle_fps(self, force=False):
+        # Calculate and display FPS, only every fps_refresh seconds
+        now = time.perf_counter()
+        if not force and now - self.fps_updated < self.fps_refresh:
+            return
+
+        self.fps_updated = now
         fps = self.clock.get_fps()
-        fps_text = self.font.render(f"FPS: {fps:.2f}", True, (255, 255, 255))  # White color
-        self.screen.blit(fps_text, (10, 10))  # Draw the FPS text in the top left corner
+        fps_text, changed = self.text_cache.render("fps", f"FPS: {fps:.2f}")
+        if changed or force:
+            self.clear_region(self.fps_rect)
+            self.screen.blit(fps_text, (10, 10))  # Draw the FPS text in the top left corner
+
+        if self.profiler is not None:
+            self.draw_profile(force)
+            self.profiler.export(frame=self.view.frames, fps=fps)
+
+    def draw_profile(self, force=False):
+        # Rolling p50 and p99 of every phase in microseconds, below the FPS text
+        lines = ["phase            p50      p99 us"]
+        for phase, values in self.profiler.summary().items():
+            lines.append(f"{phase:<16} {values['p50_us']:>7.1f} {values['p99_us']:>8.1f}")
+
+        if lines == self.prev_profile and not force:
+            return
+
+        self.prev_profile = lines
+        self.clear_region(self.profile_rect)
+        for line_index, line in enumerate(lines[:self.profile_rect.height // 20]):
+            text, _ = self.profile_cache.render(f"profile {line_index}", line)
+            self.screen.blit(text, (10, self.profile_rect.y + line_index * 20))
 
     def draw_scores(self):
-        # Display level and score
-        level = self.engine.level
-        score = self.engine.score
-        level_text = self.font.render(f"Level: {level}", True, (255, 255, 255))
-        score_text = self.font.render(f"Score: {score}", True, (255, 255, 255))
+        # Display level and score, only redrawn when they change
+        level = self.view.level
+        score = self.view.score
+        if (level, score) == self.prev_scores:
+            return
+
+        self.prev_scores = (level, score)
+        level_text, _ = self.text_cache.render("level", f"Level: {level}")
+        score_text, _ = self.text_cache.render("score", f"Score: {score}")
 
         level_pos = (self.SCREEN_WIDTH - 150, 10)
         score_pos = (self.SCREEN_WIDTH - 150, 60)
 
+        self.clear_region(self.scores_rect)
         self.screen.blit(level_text, level_pos)
         self.screen.blit(score_text, score_pos)
 
     def draw_main_lines(self):
+        board = self.board_rect
         # Vertical lines
-        pygame.draw.line(self.screen, (255, 255, 255), (250, 0), (250, 800), 5)
-        pygame.draw.line(self.screen, (255, 255, 255), (550, 0), (550, 800), 5)
+        pygame.draw.line(self.screen, (255, 255, 255), (board.left, 0), (board.left, 800), 5)
+        pygame.draw.line(self.screen, (255, 255, 255), (board.right, 0), (board.right, 800), 5)
         # Horizontal lines
-        pygame.draw.line(self.screen, (255, 255, 255), (250, 100), (550, 100), 5)
-        pygame.draw.line(self.screen, (255, 255, 255), (250, 700), (550, 700), 5)
+        pygame.draw.line(self.screen, (255, 255, 255), (board.left, board.top), (board.right, board.top), 5)
+        pygame.draw.line(self.screen, (255, 255, 255), (board.left, board.bottom), (board.right, board.bottom), 5)
 
     def rectangle_with_border(self, x, y, width, height, bg_color, border_color, border_thickness, border_radius):
         # Border thickness between 1 and 10
@@ -135,30 +313,44 @@ class Render:
         pygame.draw.rect(self.screen, border_color, background_rect, border_radius=border_radius)
         pygame.draw.rect(self.screen, bg_color, foreground_rect)
 
-    def draw_next_shape(self):
+    def draw_next_box(self):
         # Draw box
-        x, y, w, h = 580, 320, 150, 150
+        x, y, w, h = self.next_box
         bg_color = "black"
         border_color = "cyan"
         self.rectangle_with_border(x, y, w, h, bg_color, border_color, 20, 5)
 
-        # Write text and show next object
-        text = self.font.render("NEXT", True, (255, 255, 255))
+        # Write text
+        text, _ = self.text_cache.render("next", "NEXT")
         self.screen.blit(text, (x + 30, y + 10))
 
+    def draw_next_shape(self):
+        # Show next object inside the box, only redrawn when it changes
+        next_shape = self.view.next_shape
+        # Nothing spawned yet when the first frame is drawn before the first tick
+        if next_shape is None:
+            return
+
+        color = self.view.color_of(self.view.next_object_id)
+        if (next_shape[0], color) == self.prev_next:
+            return
+
+        self.prev_next = (next_shape[0], color)
+        x, y, w, h = self.next_box
+        self.clear_region(self.next_shape_rect)
+
         # Align the shape into the box
-        if self.engine.next_shape[0] == 6:
+        if next_shape[0] == 6:
             cur_x, cur_y = x + 15, y + 60
-        elif self.engine.next_shape[0] == 3:
+        elif next_shape[0] == 3:
             cur_x, cur_y = x + 45, y + 60
         else:
             cur_x, cur_y = x + 30, y + 60
 
-        for row in self.engine.next_shape[1]:
+        for row in next_shape[1]:
             for cell in row:
                 if cell != 0:
                     rectangle = pygame.Rect((cur_x, cur_y, 30, 30))
-                    color = self.engine.rectangle_dict.get(self.engine.next_object_id)[1]
                     pygame.draw.rect(self.screen, color, rectangle, border_radius=6, width=5)
 
                 cur_x += 30
@@ -169,883 +361,148 @@ class Render:
     def draw_stats(self):
         pass
 
-    def draw_game_area(self):
+    def draw_background(self):
+        # Everything that never changes is drawn once and copied to the background surface
+        self.screen.fill((0, 0, 0))
         self.draw_main_lines()
-        self.draw_next_shape()
-        self.draw_scores()
-        self.draw_stats()
-
-    def draw_shapes(self):
-        cur_x = 250.0
-        cur_y = 100.0
-
-        for row in self.engine.state:
-            for cell in row:
-                if cell != 0:
-                    rectangle = pygame.Rect((cur_x, cur_y, 30, 30))
-                    color = self.engine.rectangle_dict.get(cell)[1]
-                    pygame.draw.rect(self.screen, color, rectangle, border_radius=6, width=5)
-
-                cur_x += 30
-
-            cur_x -= 300
-            cur_y += 30
-
-    def execute(self):
-        if self.enable_sound:
-            self.main_track.play()
-
-        while not self.engine.game_end:
-            # Update engine
-            self.engine.update()
-
-            # Render
-            self.screen.fill((0, 0, 0))
-            self.draw_game_area()
-            self.draw_shapes()
-
-            self.handle_events()
-            self.handle_keys()
-            self.handle_fps()
-
-            # Update the screen
-            pygame.display.update()
-
-            # Limit to 60 frames per second
-            dt = self.clock.tick(60) / 1000
-            self.timer -= dt
-            self.move_timer -= dt
-
-        self.cleanup()
-
-    def cleanup(self):
-        pygame.quit()
-
-
-class Engine:
-    """
-    Game state:
-
-    Game will be a grid of 20x10 rows:20, cols:10
-    New shapes will spawn in the first 2 rows in top
-    New shape is max size 2x4
-
-    Update loop (in order):
-
-    1. If tetris mode: Keep only updating the falling pieces and return
-    2. Primary shape exists: Keep dropping the primary piece, also if tetris mode can happen
-    3. No primary shape: generate one
-
-    Score and level system:
-
-    Every 10 tetris cleared a new level will begin
-    Score is calculated based on this formula points_for_tetris_lines * (level + 1)
-    """
-
-    def __init__(self):
-        self.state: List[List[int]] = []
-
-        self.init_state()
-        self.key_buffer = []
-        self.frames = 0
-
-        # Speed calculated from 16.6ms * self.speed --> lower the speed faster the update
-        self.speed = 30
-
-        # Shapes are max size 2x4
-        self.all_shapes = [
-            [
-                [1, 1, 1, 0],
-                [0, 1, 0, 0]
-            ],
-            [
-                [1, 1, 1, 0],
-                [0, 0, 1, 0]
-            ],
-            [
-                [1, 1, 0, 0],
-                [0, 1, 1, 0]
-            ],
-            [
-                [1, 1, 0, 0],
-                [1, 1, 0, 0]
-            ],
-            [
-                [0, 1, 1, 0],
-                [1, 1, 0, 0]
-            ],
-            [
-                [1, 1, 1, 0],
-                [1, 0, 0, 0]
-            ],
-            [
-                [1, 1, 1, 1],
-                [0, 0, 0, 0]
-            ]
-        ]
-        self.shape_bucket = self.make_bucket_sort()
-
-        # ID counter for objects
-        self.id_counter = 0
-        self.game_end = False
-
-        # Save the coordinates for top left corner of the shape
-        self.last_spawned_object_id: Optional[int] = None
-        self.last_spawned_object_row: Optional[int] = None
-        self.last_spawned_object_col: Optional[int] = None
-        self.last_spawned_shape_id: Optional[int] = None  # Save the index based on all_shapes array
-        self.last_spawned_center: Optional[List[int, int]] = None  # Used for tracking the center for rotation
-        self.prev_color: Optional[str] = None
-
-        # Next shape
-        self.next_shape = None
-        self.next_object_id = None
-
-        # Tetris memory
-        self.tetris_bottom_row = None
-        self.prev_tetris_row = 0
-        self.total_tetris_rows = 0
-
-        self.level = 0
-        self.score = 0
-
-        # Save color for each object id: [recs_left, color]
-        self.rectangle_dict = {
-            0: [0, "blue"],
-        }
-
-        self.colorer = Colors()
-        self.spawn_new = True
-
-    def init_state(self):
-        for row in range(20):
-            new_line = []
-            for col in range(10):
-                new_line.append(0)
-
-            self.state.append(new_line)
-
-    def make_bucket_sort(self):
-        # Fill bucket with all 7 shapes
-        return [(shape_id, self.all_shapes[shape_id]) for shape_id in range(7)]
-
-    def gen_id(self):
-        self.id_counter += 1
-        return self.id_counter
-
-    def random_color(self):
-        # Choose new random color that is not the same as previous
-        colors = ["white", "red", "green", "yellow", "orange"]
-        new_color = random.choice(colors)
-        while new_color == self.prev_color:
-            new_color = random.choice(colors)
-
-        self.prev_color = new_color
-        return new_color
-
-    def print_state(self):
-        # os.system("cls")
-        for i, row in enumerate(self.state):
-            for j, cell in enumerate(row):
-                color = "white" if (self.last_spawned_object_row == i and self.last_spawned_object_col == j) else \
-                    self.rectangle_dict.get(cell)[1]
-                print(self.colorer.color_text(f" {cell} ", color), end="")
-            print("\n", end="")
-
-        print("\n")
-
-    def assign_last_spawn_object_vars(self, random_shape, rand_col) -> None:
-        for col in range(3, -1, -1):
-            for row in range(2):
-                if random_shape[row][col] != 0:
-                    self.last_spawned_object_row = row
-                    self.last_spawned_object_col = col + rand_col
-
-    def get_next_shape(self):
-        # If all shapes used, generate bucket again
-        if len(self.shape_bucket) == 0:
-            self.shape_bucket = self.make_bucket_sort()
-
-        # Choose random index based on amount of items in bucket
-        random_int = random.randint(0, len(self.shape_bucket) - 1)
-        random_shape = self.shape_bucket[random_int]
-        self.shape_bucket.pop(random_int)
-
-        # Generate new id for the shape
-        new_id = self.gen_id()
-
-        # Save memory for the amount of blocks left in shape and color
-        self.rectangle_dict[new_id] = [4, self.random_color()]
-
-        return random_shape, new_id
-
-    def spawn_shape(self):
-        # Check if next shape already exists, if not create it otherwise use it
-        # This is for showing the next falling object
-        if self.next_shape is not None:
-            random_choice = self.next_shape
-            current_object_id = self.next_object_id
-        elif self.next_shape is None:
-            random_choice, current_object_id = self.get_next_shape()
-        else:
-            raise ("New shape was not able to be generated")
-
-        self.next_shape, self.next_object_id = self.get_next_shape()
-        # Save id of the shape
-        self.last_spawned_shape_id = random_choice[0]
-        # Take the array for the shape
-        random_shape = random_choice[1]
-
-        # Choose random col to spawn
-        random_col = random.randint(0, 6)
-        self.last_spawned_center = [0, random_col + 1]
-
-        # Save the position of spawned object for fast access later on (BOTTOM_LEFT_CORNER)
-        self.assign_last_spawn_object_vars(random_shape, random_col)
-        self.last_spawned_object_id = current_object_id
-
-        for row in range(len(random_shape)):
-            for col in range(len(random_shape[0])):
-                # Spawn rectangle to the shape
-                self.state[row][random_col + col] = 0 if random_shape[row][col] == 0 else current_object_id
-
-    def find_rectangle(self, cur_x, cur_y, object_id):
-        """
-        Check the column and find the bottom rectangle belonging to object_id
-        returns cur_x, cur_y, object_found
-        :param cur_x: int
-        :param cur_y: int
-        :param object_id:int
-        :return: (int, int, bool)
-        """
-        # Check current pos
-        if self.state[cur_x][cur_y] == object_id:
-            return cur_x, cur_y, True
-
-        # First find the id on the col, max 4 steps up and down
-        # Check up
-        for i in range(4):
-            if cur_x - i < 0:
-                continue
-            if self.state[cur_x - i][cur_y] == object_id:
-                return cur_x - i, cur_y, True
-
-        # Check down
-        for i in range(4):
-            if cur_x + i > 19:
-                continue
-            if self.state[cur_x + i][cur_y] == object_id:
-                return cur_x + i, cur_y, True
-
-        return cur_x, cur_y, False
-
-    def find_shape(self, object_id):
-        for row in range(20):
-            for col in range(10):
-                if self.state[row][col] == object_id:
-                    return row, col
-
-    def reset_falling_object_vars(self, object_id: int) -> None:
-        # If the main falling object hit bottom make fast access coordinates None
-        if object_id == self.last_spawned_object_id:
-            self.last_spawned_object_id = None
-            self.last_spawned_object_row = None
-            self.last_spawned_object_col = None
-            self.last_spawned_shape_id = None
-            self.last_spawned_center = None
-
-    def collision_detection_vertical(self, object_id):
-        # First find shape start
-        if object_id == self.last_spawned_object_id:
-            start_row = self.last_spawned_object_row
-            start_col = self.last_spawned_object_col
-        else:
-            start_row, start_col = self.find_shape_reverse(object_id)
-
-        # Figure out which squares below the shape have to be checked
-        # From starting position start looping through columns and then through rows
-
-        # STEPS:
-        # 1. DO UNTIL ID FOUND:
-        # 1.1 check current pos
-        # 1.2 at current position if no object_id found go up max one step
-        # 1.3 go down max one step
-        # 1.4 if still no object_id found stop and return False
-        # 2. go down until find either 0 or another object_id
-        # 3. if another object_id was found return True
-        # 4. Go to next column
-        cur_row, cur_col = start_row, start_col
-
-        for col in range(4):
-            # Find bottom rectangle
-            cur_row, cur_col, object_found = self.find_rectangle(cur_row, cur_col, object_id)
-
-            # No more cols to check
-            if not object_found:
-                break
-
-            # Go down until find 0 or other object
-            while self.state[cur_row][cur_col] == object_id:
-                # check if hit bottom
-                if cur_row == 19:
-                    self.reset_falling_object_vars(object_id)
-                    return True
-
-                cur_row += 1
-
-            # Check if hit other object
-            if self.state[cur_row][cur_col] != 0:
-                self.reset_falling_object_vars(object_id)
-                return True
-
-            cur_col += 1
-            # Out of bounds
-            if cur_col > 9:
-                break
+        self.draw_next_box()
+        self.background = self.screen.copy()
 
-        return False
-
-    def collision_detection_horizontal(self, start_row, start_col, side):
-        """
-        Check for horizontal collision detection, start_row and start_col the most left or right bottom
-        rectangle of shape
-        Read collision_detection_vertical for more info
-        :param start_row:
-        :param start_col:
-        :param side: str, which side to check for collision
-        :return: bool, True if collision happened
-        """
-        # Check every surface from left or right side depending on direction
-        # Check each row separately
-        cur_row, cur_col = start_row, start_col
-        cur_row -= 3
-        for row in range(7):
-            if cur_row < 0:
-                cur_row += 1
-                continue
-            elif cur_row > 19:
-                break
+    def clear_region(self, rect: pygame.Rect):
+        # Restore the background under rect and mark it to be pushed to the display
+        self.screen.blit(self.background, rect, rect)
+        self.dirty_rects.append(rect)
 
-            id_found = False
+    def cell_colors(self) -> List[Optional[str]]:
+        # Color of every cell on the board including the falling shape, None for empty cells
+        colors = self.view.pool.colors
+        cells = [PALETTE[colors[cell]] if cell != 0 else None for row in self.view.state for cell in row]
 
-            # Go left max 4 in that row until object id found, if not found stop because shape ended and return
-            for col in range(4):
-                if cur_col < 0 or cur_col > 9:
-                    continue
+        # Falling shape is not part of the state until it locks, ghost shows where it would land
+        if self.view.last_spawned_object_id is not None:
+            width = self.view.width
+            ghost_offset = self.view.ghost_row() - self.view.last_spawned_object_row
+            for row, col in self.view.piece_cells():
+                cells[(row + ghost_offset) * width + col] = "gray40"
 
-                if self.state[cur_row][cur_col] == self.last_spawned_object_id:
-                    id_found = True
-                    break
+            color = self.view.color_of(self.view.last_spawned_object_id)
+            for row, col in self.view.piece_cells():
+                cells[row * width + col] = color
 
-                if side == "right":
-                    cur_col -= 1
-                elif side == "left":
-                    cur_col += 1
+        return cells
 
-            if not id_found:
-                cur_row += 1
-                cur_col = start_col
+    def draw_shapes(self):
+        # Only cells that changed since last frame are redrawn
+        cells = self.cell_colors()
+        prev_cells = self.prev_cells
+        width = self.view.width
+        size = self.cell_size
+        # Border is 5 and corner radius 6 pixels with the default 30 pixel cells
+        border = max(1, size // 6)
+        radius = size // 5
+        for index, color in enumerate(cells):
+            if prev_cells is not None and prev_cells[index] == color:
                 continue
 
-            # Check if collision happens
-            if side == "right":
-                if cur_col + 1 == 10 or self.state[cur_row][cur_col + 1] != 0:
-                    return True
-            elif side == "left":
-                if cur_col - 1 == -1 or self.state[cur_row][cur_col - 1] != 0:
-                    return True
+            row, col = divmod(index, width)
+            rectangle = pygame.Rect((self.board_rect.left + col * size, self.board_rect.top + row * size, size, size))
+            self.clear_region(rectangle)
+            if color is not None:
+                pygame.draw.rect(self.screen, color, rectangle, border_radius=radius, width=border)
 
-            cur_row += 1
-            cur_col = start_col
+        self.prev_cells = cells
 
-        return False
+    def redraw_all(self):
+        # Forget what is on the screen so next frame draws everything
+        self.prev_cells = None
+        self.prev_next = None
+        self.prev_scores = None
 
-    def find_shape_reverse(self, object_id):
-        for col in range(10):
-            for row in range(19, -1, -1):
-                if self.state[row][col] == object_id:
-                    return row, col
+    def draw_frame(self):
+        self.dirty_rects = []
+        full_redraw = self.prev_cells is None
+        if full_redraw:
+            self.screen.blit(self.background, (0, 0))
 
-    def lazy_game_end(self) -> bool:
-        # Only going to check that if there is piece in the top 2 rows when trying to spawn new game ends
-        for row in range(2):
-            for col in range(10):
-                if self.state[row][col] != 0:
-                    return True
+        self.draw_next_shape()
+        self.draw_scores()
+        self.draw_stats()
+        self.draw_shapes()
+        self.handle_fps(force=full_redraw)
 
-        return False
+        profiler = self.profiler
+        if profiler is not None:
+            start = perf_counter_ns()
 
-    def bottom_left_rectangle(self, cur_row, cur_col, object_id) -> (int, int):
-        # Start looking for object id 4 cols from the left to right
-        best_position = [cur_row, cur_col]
-
-        def dfs(row, col, object_id):
-            if row < 0 or row > 19 or col < 0 or col > 9:
-                return
-
-            # If object_id not found return
-            if self.state[row][col] != object_id:
-                return
-
-            # If found more left object
-            if col < best_position[1]:
-                best_position[0], best_position[1] = row, col
-            # If found more bottom left object
-            elif col == best_position[1] and row > best_position[0]:
-                best_position[0], best_position[1] = row, col
-
-            # Travel left, top, bottom
-            moves = [(0, -1), (-1, 0), (1, 0)]
-            for move in moves:
-                dfs(row + move[0], col + move[1], object_id)
-
-        dfs(cur_row, cur_col, object_id)
-
-        return best_position[0], best_position[1]
-
-    def bottom_column_position(self, cur_row, cur_col, object_id) -> Tuple[int, int]:
-        # Get to the bottom in this col
-        for _ in range(4):
-            # First there is object below
-            if cur_row + 1 <= 19 and self.state[cur_row + 1][cur_col] == object_id:
-                cur_row += 1
-            # We are at lowest
-            elif self.state[cur_row][cur_col] == object_id:
-                break
-            # Have to go up to find the bottom
-            elif cur_row - 1 >= 0:
-                cur_row -= 1
-
-        return cur_row, cur_col
-
-    def move(self, object_id):
-        # loop through cols and rows[::-1] and move everything down
-        # First find shape start
-        if object_id == self.last_spawned_object_id:
-            start_row = self.last_spawned_object_row
-            start_col = self.last_spawned_object_col
+        # Update only the changed parts of the screen
+        if full_redraw:
+            pygame.display.update()
         else:
-            start_row, start_col = self.find_shape_reverse(object_id)
-
-        # 1. Find the bottom left rectangle if not primary object
-        if object_id != self.last_spawned_object_id:
-            start_row, start_col = self.bottom_left_rectangle(start_row, start_col, object_id)
-
-        # 2. Col by col move every id in that col down
-        cur_row, cur_col = start_row, start_col
-        for col in range(4):
-            # Out of bounds
-            if cur_col < 0 or cur_col > 9:
-                cur_col += 1
-                continue
+            pygame.display.update(self.dirty_rects)
 
-            # Get to the bottom in this col
-            cur_row, cur_col = self.bottom_column_position(cur_row, cur_col, object_id)
-            for row in range(4):
-                if cur_row < 0 or cur_row > 19:
-                    cur_row -= 1
-                    continue
+        if profiler is not None:
+            profiler.add("render.display", perf_counter_ns() - start)
 
-                # Do not move 0
-                if self.state[cur_row][cur_col] == 0:
-                    cur_row -= 1
-                    continue
-
-                self.state[cur_row + 1][cur_col] = self.state[cur_row][cur_col]
-                self.state[cur_row][cur_col] = 0
-                cur_row -= 1
-
-            cur_row += 4
-            cur_col += 1
-
-        # Update the position for falling object
-        if object_id == self.last_spawned_object_id:
-            self.last_spawned_object_row += 1
-            self.last_spawned_center[0] += 1
-
-    def manual_move(self, direction: str) -> None:
-        """
-        Move falling shape to given direction by one block
-        :param direction: Left or right
-        :return:
-        """
-        if self.last_spawned_object_id is None:
-            return
-
-        # Based on left or right get to most left or right column of the shape
-        start_row = self.last_spawned_object_row
-        start_col = self.last_spawned_object_col
-
-        if direction == "right":
-            most_right = [start_row, start_col]
-
-            # Use dfs to find most right column
-            def dfs(row, col, object_id, visited_nodes: List):
-                # Check out of bounds
-                if not (0 <= row <= 19) or not (0 <= col <= 9):
-                    return
-                # Check if path still valid
-                if self.state[row][col] != object_id:
-                    return
-                if (row, col) in visited_nodes:
-                    return
-
-                if col > most_right[1]:
-                    most_right[0], most_right[1] = row, col
-
-                # Travel right, top, bottom
-                moves = [(0, 1), (-1, 0), (1, 0)]
-                for move in moves:
-                    visited_nodes.append((row, col))
-                    dfs(row + move[0], col + move[1], object_id, visited_nodes)
-                    visited_nodes.pop()
-
-            dfs(start_row, start_col, self.last_spawned_object_id, [])
-            start_row, start_col = most_right[0], most_right[1]
-            # Get the most bottom value also
-            self.bottom_column_position(start_row, start_col, self.last_spawned_object_id)
-
-        # Make certain object is not horizontally hitting something
-        if self.collision_detection_horizontal(start_row, start_col, direction):
-            return
-
-        # Move every id column per column to right or left
-        cur_row, cur_col = start_row, start_col
-        for col in range(4):
-            if cur_col < 0 or cur_col > 9:
-                cur_col = cur_col - 1 if direction == "right" else cur_col + 1
-                continue
-
-            cur_row, cur_col = self.bottom_column_position(cur_row, cur_col, self.last_spawned_object_id)
-            for row in range(4):
-                if cur_row < 0 or cur_row > 19:
-                    cur_row -= 1
-                    continue
-                # Only move right id
-                if self.state[cur_row][cur_col] != self.last_spawned_object_id:
-                    cur_row -= 1
-                    continue
-
-                if direction == "right":
-                    self.state[cur_row][cur_col + 1] = self.state[cur_row][cur_col]
-                elif direction == "left":
-                    self.state[cur_row][cur_col - 1] = self.state[cur_row][cur_col]
-
-                self.state[cur_row][cur_col] = 0
-                cur_row -= 1
-
-            cur_row += 4
-            cur_col = cur_col - 1 if direction == "right" else cur_col + 1
-
-        if direction == "right":
-            self.last_spawned_object_col += 1
-            self.last_spawned_center[1] += 1
-        elif direction == "left":
-            self.last_spawned_object_col -= 1
-            self.last_spawned_center[1] -= 1
-
-    def manual_rotate(self) -> None:
-        """
-        Rotates the falling shape clockwise
-        :return:
-        """
-        if self.last_spawned_object_id is None:
-            return
-
-        if self.last_spawned_shape_id == 3:
-            return
+    def execute(self):
+        if self.enable_sound:
+            self.sound.play()
 
-        # Also don't rotate if piece has not fallen yet at all
-        if self.last_spawned_center[0] < 1:
-            return
+        if self.threaded:
+            self.simulation.start()
+        else:
+            self.timestep.reset_clock()
 
-        # Deal with long piece separately
-        if self.last_spawned_shape_id == 6:
-            # Make certain there is no collision and rotate area does not go out of bounds
-            c_row, c_col = self.last_spawned_center[0] - 1, self.last_spawned_center[1] - 1
-            if not (0 <= c_row + 3 <= 19 and 0 <= c_col + 3 <= 9 and 0 <= c_row <= 19 and 0 <= c_col <= 9):
-                return
-
-            for row in range(4):
-                for col in range(4):
-                    if self.state[c_row + row][c_col + col] != self.last_spawned_object_id and self.state[c_row + row][
-                        c_col + col] != 0:
-                        return
-
-            i = self.last_spawned_object_id
-            rotate_1 = [[0, 0, 0, 0], [i, i, i, i], [0, 0, 0, 0], [0, 0, 0, 0]]
-            rotate_2 = [[0, 0, i, 0], [0, 0, i, 0], [0, 0, i, 0], [0, 0, i, 0]]
-
-            # Get whether the shape is vertical or horizontal
-            vertical = True if self.state[c_row][c_col + 2] != 0 else False
-            for row in range(4):
-                for col in range(4):
-                    # Currently vertical
-                    if vertical:
-                        self.state[c_row + row][c_col + col] = rotate_1[row][col]
-                        if row == 3 and col == 3:
-                            self.last_spawned_object_row = c_row + 1
-                            self.last_spawned_object_col = c_col
-                    else:
-                        self.state[c_row + row][c_col + col] = rotate_2[row][col]
-                        if row == 3 and col == 3:
-                            self.last_spawned_object_row = c_row + 3
-                            self.last_spawned_object_col = c_col + 2
+        while not self.view.game_end:
+            # Profiler can be switched on and off by events, so it is read once per frame
+            profiler = self.profiler
+            if profiler is not None:
+                start = perf_counter_ns()
 
-            return
+            # Run the engine ticks that are due, slow frames are caught up with more ticks
+            if self.threaded:
+                self.view = self.simulation.latest
+            else:
+                self.timestep.advance()
 
-        # Check for border collision
-        if not (0 <= self.last_spawned_center[0] - 1 <= 19) or not (0 <= self.last_spawned_center[1] - 1 <= 9):
-            return
+            if profiler is not None:
+                now = perf_counter_ns()
+                profiler.add("render.engine", now - start)
+                start = now
 
-        # 3x3 collision check
-        for row in range(3):
-            for col in range(3):
-                x = self.last_spawned_center[0] - 1 + row
-                y = self.last_spawned_center[1] - 1 + col
-                # Check for t-shape collision against the wall
-                if x < 0 or x > 19 or y < 0 or y > 9:
-                    return
-
-                cell = self.state[x][y]
-                if cell != self.last_spawned_object_id and cell != 0:
-                    return
-
-        # Works for every piece but long!
-        # Take 3 by 3 area around the center
-        # Also sametime override old values in state
-        row1, row2 = self.last_spawned_center[0] - 1, self.last_spawned_center[0] - 1 + 3
-        col1, col2 = self.last_spawned_center[1] - 1, self.last_spawned_center[1] - 1 + 3
-
-        temp_area = []
-        for row in range(row1, row2):
-            temp_line = []
-            for col in range(col1, col2):
-                temp_line.append(self.state[row][col])
-                self.state[row][col] = 0
-
-            temp_area.append(temp_line)
-
-        # Transpose the matrix (swap rows with columns)
-        transposed_matrix = [list(row) for row in zip(*temp_area)]
-        # Reverse each row to get the 90-degree rotation
-        temp_area = [row[::-1] for row in transposed_matrix]
-
-        # Some shapes like purple zigzag after 2nd rotation has to move down
-        # If there is empty row as 3rd move everything down
-        if temp_area[2].count(0) == 3:
-            temp_area[2] = temp_area[1]
-            temp_area[1] = temp_area[0]
-            temp_area[0] = [0, 0, 0]
-
-        # Now based on how many rectangles at bottom to align the shape
-        # 1. 3 wide object --> alignment done
-        # 2. 2 wide bottom object --> check which col has more squares, that becomes the center ONLY IF not 3 total width
-        # 3. 1 wide bottom object --> just align to middle
-
-        # Find bottom_wide_value
-        bottom_wide_value = None
-        width_array = [0, 0, 0]
-        for row in range(3):
-            id_count = 0
-            for col in range(3):
-                if temp_area[row][col] == self.last_spawned_object_id:
-                    width_array[col] = 1
-                    id_count += 1
-
-            if id_count == 3:
-                bottom_wide_value = 3
-                break
-
-            if row == 2:
-                bottom_wide_value = id_count
-
-        total_width = width_array.count(self.last_spawned_object_id)
-
-        # Find the highest col for bottom 2
-        highest_col = None
-        if bottom_wide_value == 2:
-            col_highest_count = 0
-            for col in range(3):
-                temp_counter = 0
-                for row in range(2, -1, -1):
-                    if temp_area[row][col] != self.last_spawned_object_id:
-                        continue
-
-                    temp_counter += 1
-
-                if temp_counter > col_highest_count:
-                    highest_col = col
-                    col_highest_count = temp_counter
+            self.draw_frame()
+            if profiler is not None:
+                # Includes render.display
+                now = perf_counter_ns()
+                profiler.add("render.draw", now - start)
+                start = now
 
-        """
-        example:
-        [0, 1, 0]       [1, 0, 0]     
-        [0, 1, 1] -->   [1, 1, 0] 
-        [0, 0, 1]       [0, 1, 0] 
-        """
-        # Align bottom if it is 2 wide and total wide not 3 or 1 wide and in need for offset
-        if (bottom_wide_value == 2 and total_width != 3 and highest_col != 1) or (
-                bottom_wide_value == 1 and temp_area[2][1] == 0):
-            new_matrix = [[0 for _ in range(3)] for _ in range(3)]
-            for row in range(3):
-                for col in range(3):
-                    # Move everything to left
-                    if (temp_area[2][0] == 0 and bottom_wide_value == 1) or (
-                            bottom_wide_value == 2 and highest_col == 2):
-                        if col < 2:
-                            new_matrix[row][col] = temp_area[row][col + 1]
-                        else:
-                            new_matrix[row][col] = 0
-                    # Move everything to right
-                    elif (temp_area[2][2] == 0 and bottom_wide_value == 1) or (
-                            bottom_wide_value == 2 and highest_col == 0):
-                        if col > 0:
-                            new_matrix[row][col] = temp_area[row][col - 1]
-                        else:
-                            new_matrix[row][col] = 0
-
-            temp_area = new_matrix
-
-        # Apply changes
-        # Setup top right corner as starting point for object tracking
-        self.last_spawned_object_row = self.last_spawned_center[0] - 1
-        self.last_spawned_object_col = self.last_spawned_center[1] - 1 + 2
-
-        for row in range(3):
-            for col in range(3):
-                new_row = self.last_spawned_center[0] - 1 + row
-                new_col = self.last_spawned_center[1] - 1 + col
-                if self.state[new_row][new_col] != 0 and self.state[new_row][new_col] != self.last_spawned_object_id:
-                    return
-
-                self.state[new_row][new_col] = temp_area[row][col]
-
-                # Update row, col tracking
-                if temp_area[row][col] == self.last_spawned_object_id:
-                    if new_col < self.last_spawned_object_col:
-                        self.last_spawned_object_row = new_row
-                        self.last_spawned_object_col = new_col
-                    elif new_col == self.last_spawned_object_col and new_row > self.last_spawned_object_row:
-                        self.last_spawned_object_row = new_row
-                        self.last_spawned_object_col = new_col
-
-    def tetris(self) -> None:
-        tetris_count = 0
-
-        # scan whole thing, count destroyed recs for each object
-        for row in range(20):
-            if 0 in self.state[row]:
-                continue
+            self.handle_events()
+            if profiler is not None:
+                now = perf_counter_ns()
+                profiler.add("render.events", now - start)
+                start = now
 
-            self.prev_tetris_row += 1
-            tetris_count += 1
-            self.tetris_bottom_row = row
-            for col in range(10):
-                object_state = self.rectangle_dict[self.state[row][col]]
-                if object_state[0] == 1:
-                    del self.rectangle_dict[self.state[row][col]]
-                else:
-                    object_state[0] -= 1
-
-                self.state[row][col] = 0
-
-        if tetris_count != 0:
-            pygame.mixer.Sound("soundtracks/SFX 10.mp3").play()
-            self.total_tetris_rows += tetris_count
-            match tetris_count:
-                case 1:
-                    self.score += 40 * (self.level + 1)
-                case 2:
-                    self.score += 80 * (self.level + 1)
-                case 3:
-                    self.score += 300 * (self.level + 1)
-                case 4:
-                    self.score += 1200 * (self.level + 1)
-
-            # Update level
-            # Speed up the game with formula 30 - (level * 2) Meaning after 150 tetris aka lvl 15 reach max speed
-            self.level = self.total_tetris_rows // 10
-            self.speed = 30 - (self.level * 2)
-
-            if self.speed < 1:
-                self.speed = 1
-
-    def tetris_move(self):
-        # Move every rectangle down to the bottom tetris line
-        # When moving lines this way have to copy otherwise python will mess up with references
-        for row in range(self.tetris_bottom_row - 1, -1, -1):
-            self.state[row + 1] = self.state[row].copy()
-
-    def update(self):
-        """
-        Steps to happen
-        1. Loop until tetris over update all object to fall
-        2. Move primary object if exists
-        3. Spawn new primary object if not exists
-        :return:
-        """
-        # Run all the key_events
-        for event in self.key_buffer:
-            # Make certain the primary object exists
-            if self.spawn_new is True:
-                break
-
-            if event == "left":
-                self.manual_move("left")
-            elif event == "right":
-                self.manual_move("right")
-            elif event == "rotate":
-                self.manual_rotate()
-            elif event == "down":
-                collision_bool = self.collision_detection_vertical(self.last_spawned_object_id)
-
-                # If no collision move down
-                if not collision_bool:
-                    self.move(self.last_spawned_object_id)
-                # If collided object was last spawned, spawn new one
-                else:
-                    # Check for tetris
-                    self.tetris()
-                    self.spawn_new = True
-
-        self.key_buffer = []
-
-        # Use prev_tetris count to know how many updates to skip for falling tetris parts
-        if self.prev_tetris_row > 0 and self.frames & self.speed == 0:
-            self.tetris_move()
-            self.prev_tetris_row -= 1
-            # Check for cascading tetris
-            if self.prev_tetris_row == 0:
-                self.tetris_bottom_row = None
-                self.tetris()
-
-            self.frames += 1
-            return
+            self.handle_keys()
+            if profiler is not None:
+                now = perf_counter_ns()
+                profiler.add("render.keys", now - start)
+                start = now
 
-        # Move primary down
-        if self.spawn_new is False and self.frames % self.speed == 0:
-            collision_bool = self.collision_detection_vertical(self.last_spawned_object_id)
+            # Limit the draw rate, game speed does not depend on it
+            dt = self.clock.tick(self.max_fps) / 1000
+            if profiler is not None:
+                profiler.add("render.wait", perf_counter_ns() - start)
 
-            # If no collision move down
-            if not collision_bool:
-                self.move(self.last_spawned_object_id)
-            # If collided object was last spawned, spawn new one
-            else:
-                # Check for tetris
-                self.tetris()
-                self.spawn_new = True
+            self.timer -= dt
+            self.move_timer -= dt
 
-        # Spawn a new shape
-        if self.spawn_new is True and self.prev_tetris_row == 0:
-            if self.lazy_game_end():
-                self.game_end = True
-                return
+        if self.threaded:
+            self.simulation.stop()
 
-            self.spawn_shape()
-            self.spawn_new = False
+        self.cleanup()
 
-        self.frames += 1
+    def cleanup(self):
+        pygame.quit()
 
 
 def main():
@@ -1068,6 +525,12 @@ def main():
 if __name__ == '__main__':
     # main()
 
+    # PROFILE=1 shows phase timings next to the FPS, PROFILE=file.jsonl also writes them to the file
+    profile = os.environ.get("PROFILE")
+    profiler = None
+    if profile:
+        profiler = Profiler(output=open(profile, "a") if profile != "1" else None)
+
     engine = Engine()
-    renderer = Render(engine, enable_sound=False)
+    renderer = Render(engine, enable_sound=False, profiler=profiler)
     renderer.execute()
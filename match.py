@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import random
+import time
+from operator import attrgetter
+from typing import List, Optional, Tuple
+from engine import Engine, ROWS, COLS
+from profiler import Profiler
+
+"""
+Match host: hundreds of boards in one process, head-to-head or battle royale. Every board is a normal Engine,
+line clears send garbage rows to an opponent of the same match.
+
+Boards are not updated every tick. The host keeps one timing wheel for everything that waits for a tick: every
+board is in the slot of its next event frame (gravity, spawn, tetris) and client timers are there too, so a tick
+only touches the boards that have something to do. Clients are asyncio tasks, they run between ticks and send
+keys with MatchHost.send_keys, the keys are given to the board on the next tick.
+
+Game logic only counts ticks, never wall clock, and boards due on the same tick are updated in player order.
+Each game is still its own deterministic game: its engine seed, keys (Engine.input_log) and the garbage it got
+(Player.garbage_log) are enough to replay it without the other boards.
+
+Example:
+    python match.py --boards 500 --match-size 2 --policy random --seconds 30
+    python match.py --boards 8 --match-size 8 --policy search --fast
+"""
+
+# Garbage rows sent for 0-4 cleared rows
+GARBAGE_LINES = [0, 0, 1, 2, 4]
+
+# Engine ticks per second, same as timestep.TICK_RATE
+TICK_RATE = 60
+
+
+class TimingWheel:
+    """
+    Items waiting for a tick in a ring of slots, slot is tick % size. Adding an item and taking the items of a tick
+    don't depend on how many items are waiting. Items more than size ticks away stay in their slot until their
+    round comes
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.slots: List[List[Tuple[int, object]]] = [[] for _ in range(size)]
+
+    def schedule(self, tick: int, item) -> None:
+        self.slots[tick % self.size].append((tick, item))
+
+    def pop(self, tick: int) -> list:
+        """
+        Take every item of the tick, items of earlier ticks that were not taken come too
+        :param tick: int
+        :return: list of items in the order they were scheduled
+        """
+        index = tick % self.size
+        slot = self.slots[index]
+        if not slot:
+            return []
+
+        due = [item for item_tick, item in slot if item_tick <= tick]
+        self.slots[index] = [] if len(due) == len(slot) else [entry for entry in slot if entry[0] > tick]
+        return due
+
+
+class Player:
+    def __init__(self, match: "Match", index: int, name: str, engine: Engine, start_tick: int):
+        """
+        :param match: Match the player is in
+        :param index: int, order of the player in the host, boards due on the same tick are updated in this order
+        :param name: str
+        :param engine: Engine of the board
+        :param start_tick: int, host tick of the first frame of the engine
+        """
+        self.match = match
+        self.index = index
+        self.name = name
+        self.engine = engine
+        self.start_tick = start_tick
+
+        # Own streams so garbage holes and targets don't depend on the other boards
+        self.garbage_rng = random.Random(f"garbage {engine.seed}")
+        self.target_rng = random.Random(f"target {engine.seed}")
+
+        # Incoming garbage: (lines, pieces locked when it arrived), it rises after the next piece locks
+        self.garbage: List[Tuple[int, int]] = []
+        # (frame, lines, hole col) of every garbage that rose, with the seed and input_log it replays the game
+        self.garbage_log: List[Tuple[int, int, int]] = []
+        self.lines_sent = 0
+        self.lines_received = 0
+
+        # Keys sent by the client since the last update
+        self.keys: List[str] = []
+        # Tick the board is scheduled to, older entries in the wheel are skipped
+        self.next_tick: Optional[int] = None
+        # Total rows the engine had cleared when the last tetris event came
+        self.cleared_rows = 0
+        # 1 = winner, None while playing
+        self.place: Optional[int] = None
+
+        engine.event_listener = self.handle_engine_event
+
+    @property
+    def playing(self) -> bool:
+        return self.place is None and not self.match.finished
+
+    def handle_engine_event(self, event: str) -> None:
+        if event == "tetris":
+            rows = self.engine.total_tetris_rows - self.cleared_rows
+            self.cleared_rows = self.engine.total_tetris_rows
+            self.match.attack(self, GARBAGE_LINES[min(rows, 4)])
+
+    def raise_garbage(self) -> None:
+        # Garbage that arrived before the last lock rises now, all of it with the same hole
+        engine = self.engine
+        lines = 0
+        while self.garbage and self.garbage[0][1] < engine.pieces_locked:
+            lines += self.garbage.pop(0)[0]
+
+        if lines == 0:
+            return
+
+        hole = self.garbage_rng.randrange(engine.width)
+        self.garbage_log.append((engine.frames, lines, hole))
+        self.lines_received += lines
+        engine.add_garbage(lines, hole)
+
+
+class Match:
+    def __init__(self, host: "MatchHost", number: int):
+        """
+        :param host: MatchHost running the match
+        :param number: int
+        """
+        self.host = host
+        self.number = number
+        self.players: List[Player] = []
+        self.alive: List[Player] = []
+        self.finished = False
+        self.end_tick: Optional[int] = None
+
+    def attack(self, player: Player, lines: int) -> None:
+        """
+        Send garbage from the player to a random opponent that is still alive, garbage waiting for the player
+        is cancelled first
+        """
+        while lines and player.garbage:
+            incoming, arrived = player.garbage[0]
+            cancelled = min(lines, incoming)
+            lines -= cancelled
+            if cancelled == incoming:
+                player.garbage.pop(0)
+            else:
+                player.garbage[0] = (incoming - cancelled, arrived)
+
+        opponents = [opponent for opponent in self.alive if opponent is not player]
+        if lines == 0 or not opponents:
+            return
+
+        target = player.target_rng.choice(opponents)
+        target.garbage.append((lines, target.engine.pieces_locked))
+        player.lines_sent += lines
+
+    def eliminate(self, player: Player) -> None:
+        player.place = len(self.alive)
+        self.alive.remove(player)
+
+        # Last board standing wins, a match of one plays until its board ends
+        if len(self.alive) <= 1 and (self.alive or len(self.players) == 1):
+            for winner in self.alive:
+                winner.place = 1
+
+            self.finished = True
+            self.end_tick = self.host.tick
+
+    def standings(self) -> List[Player]:
+        # Boards still playing first, then by place
+        return sorted(self.players, key=lambda player: (player.place is not None, player.place or 0))
+
+
+class MatchHost:
+    """
+    Runs every board of every match on one shared tick counter. run_tick() updates the boards that have an event on
+    the tick and wakes up the clients waiting for it, run() calls it tick_rate times per second
+    """
+
+    def __init__(self, tick_rate: float = TICK_RATE, gravity: Optional[int] = None, width: int = COLS,
+                 height: int = ROWS, wheel_size: int = 64):
+        """
+        :param tick_rate: float, ticks per second in run()
+        :param gravity: int, fixed frames per gravity step for every board, None keeps the level based speed
+        :param width: int, board width
+        :param height: int, board height
+        :param wheel_size: int, slots in the timing wheel, more than the longest wait avoids rounds
+        """
+        self.tick_rate = tick_rate
+        self.gravity = gravity
+        self.width = width
+        self.height = height
+        self.wheel = TimingWheel(wheel_size)
+        self.matches: List[Match] = []
+        self.players: List[Player] = []
+        # Next tick to run
+        self.tick = 0
+        # Board updates done by tick(), frames skipped by Engine.step are not counted
+        self.board_ticks = 0
+        # Ticks that started more than one tick late in run()
+        self.late_ticks = 0
+        self.profiler = Profiler(window=1 << 16)
+
+    def add_match(self, seeds: List[int]) -> Match:
+        """
+        New match that starts on the next tick
+        :param seeds: list of engine seeds, one board for each
+        :return: Match
+        """
+        match = Match(self, len(self.matches))
+        for seed in seeds:
+            engine = Engine(seed, record_inputs=True, width=self.width, height=self.height)
+            player = Player(match, len(self.players), f"{match.number}.{len(match.players)}", engine, self.tick)
+            match.players.append(player)
+            match.alive.append(player)
+            self.players.append(player)
+            self.schedule(player, self.tick)
+
+        self.matches.append(match)
+        return match
+
+    def schedule(self, player: Player, tick: int) -> None:
+        player.next_tick = tick
+        self.wheel.schedule(tick, player)
+
+    def send_keys(self, player: Player, keys: List[str]) -> None:
+        # Keys go to the board on the next tick, it is moved up in the wheel if it was waiting longer
+        if not player.playing:
+            return
+
+        player.keys.extend(keys)
+        if player.next_tick is not None and player.next_tick > self.tick:
+            self.schedule(player, self.tick)
+
+    def sleep_ticks(self, ticks: int) -> asyncio.Future:
+        """
+        Future that is done when the host has run given amount of ticks, for clients to wait on
+        :param ticks: int, at least 1
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.wheel.schedule(self.tick + max(1, ticks) - 1, future)
+        return future
+
+    def running(self) -> bool:
+        return any(not match.finished for match in self.matches)
+
+    def update_player(self, player: Player, tick: int) -> None:
+        engine = player.engine
+        if self.gravity is not None:
+            engine.speed = self.gravity
+
+        frame = tick - player.start_tick
+        # Nothing happens before the frame of the tick unless a key woke the board up early
+        engine.step(frame - engine.frames)
+        if player.keys:
+            engine.key_buffer.extend(player.keys)
+            player.keys = []
+
+        engine.step(1)
+        self.board_ticks += 1
+
+        # No garbage while rows are collapsing, it would move the rows that are about to fall
+        if player.garbage and engine.prev_tetris_row == 0 and not engine.game_end:
+            player.raise_garbage()
+
+        if engine.game_end:
+            player.match.eliminate(player)
+        else:
+            self.schedule(player, player.start_tick + engine.next_event_frame())
+
+    def run_tick(self) -> None:
+        # Run one tick: update the due boards in player order, then wake up the clients
+        start = time.perf_counter_ns()
+        tick = self.tick
+        players = []
+        futures = []
+        for item in self.wheel.pop(tick):
+            if isinstance(item, Player):
+                # Entry left from before the board was moved up can land on the tick it is scheduled to again
+                if item.next_tick == tick and item.playing:
+                    item.next_tick = None
+                    players.append(item)
+            else:
+                futures.append(item)
+
+        players.sort(key=attrgetter("index"))
+        for player in players:
+            self.update_player(player, tick)
+
+        self.tick += 1
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+        self.profiler.add("host.tick", time.perf_counter_ns() - start)
+
+    async def run(self, max_ticks: Optional[int] = None, realtime: bool = True) -> None:
+        """
+        Run ticks until every match is finished
+        :param max_ticks: int, stop after this many ticks
+        :param realtime: bool, tick_rate ticks per second, False runs them as fast as possible
+        """
+        loop = asyncio.get_running_loop()
+        tick_time = 1 / self.tick_rate
+        next_time = loop.time()
+        end_tick = None if max_ticks is None else self.tick + max_ticks
+        while self.running() and (end_tick is None or self.tick < end_tick):
+            self.run_tick()
+            # Clients woken up by the tick run before the next one, also when the host is behind
+            await asyncio.sleep(0)
+
+            if realtime:
+                next_time += tick_time
+                delay = next_time - loop.time()
+                if delay < -tick_time:
+                    self.late_ticks += 1
+                if delay < -1:
+                    # Far behind, don't try to catch up
+                    next_time = loop.time()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+
+async def bot_client(host: MatchHost, player: Player, policy, rng: random.Random) -> None:
+    """
+    Local client playing one board with a runner policy, called once per gravity step
+    :param host: MatchHost
+    :param player: Player to control
+    :param policy: runner policy
+    :param rng: random.Random for the policy
+    """
+    engine = player.engine
+    while player.playing:
+        await host.sleep_ticks(engine.speed)
+        if not player.playing:
+            break
+
+        keys = policy(engine, rng)
+        if keys:
+            host.send_keys(player, keys)
+
+
+async def play(boards: int, match_size: int, policy_name: str, seed: int, seconds: Optional[float],
+               realtime: bool = True, gravity: Optional[int] = None, width: int = COLS,
+               height: int = ROWS) -> MatchHost:
+    """
+    Fill a host with matches of bot clients and run it
+    :param boards: int, total amount of boards
+    :param match_size: int, boards per match, 2 is head-to-head
+    :param policy_name: str, runner policy of the bots
+    :param seed: int, board n uses seed + n
+    :param seconds: float, stop after this many seconds of ticks, None runs until every match is finished
+    :param realtime: bool, False runs ticks as fast as possible
+    :param gravity: int, fixed frames per gravity step, None keeps the level based speed
+    :param width: int, board width
+    :param height: int, board height
+    :return: MatchHost after the run
+    """
+    from runner import load_policy
+
+    policy = load_policy(policy_name)
+    host = MatchHost(gravity=gravity, width=width, height=height)
+    for first in range(0, boards, match_size):
+        host.add_match([seed + board for board in range(first, min(boards, first + match_size))])
+
+    clients = [asyncio.ensure_future(bot_client(host, player, policy, random.Random(f"policy {player.engine.seed}")))
+               for player in host.players]
+
+    max_ticks = None if seconds is None else round(seconds * host.tick_rate)
+    await host.run(max_ticks, realtime)
+
+    for client in clients:
+        client.cancel()
+
+    await asyncio.gather(*clients, return_exceptions=True)
+    return host
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host matches of bot clients in one process")
+    parser.add_argument("--boards", type=int, default=500)
+    parser.add_argument("--match-size", type=int, default=2, help="boards per match, 2 is head-to-head")
+    parser.add_argument("--policy", default="random", help="runner policy name or module:function")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first board, board n uses seed + n")
+    parser.add_argument("--seconds", type=float, help="stop after this many seconds of ticks")
+    parser.add_argument("--gravity", type=int, help="fixed frames per gravity step, 1 is the fastest")
+    parser.add_argument("--fast", action="store_true", help="run ticks as fast as possible instead of real time")
+    parser.add_argument("--width", type=int, default=COLS, help="board width")
+    parser.add_argument("--height", type=int, default=ROWS, help="board height")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        host = asyncio.run(play(args.boards, args.match_size, args.policy, args.seed, args.seconds, not args.fast,
+                                args.gravity, args.width, args.height))
+    except KeyboardInterrupt:
+        return
+
+    seconds = time.perf_counter() - start
+    tick = host.profiler.summary()["host.tick"]
+    finished = sum(match.finished for match in host.matches)
+    print(f"{len(host.players)} boards in {len(host.matches)} matches, {host.tick} ticks in {seconds:.2f}s "
+          f"({host.tick / seconds:.1f} ticks/sec), {finished} matches finished")
+    print(f"board updates: {host.board_ticks} ({host.board_ticks / seconds:.0f}/sec), late ticks: {host.late_ticks}")
+    print(f"tick time: p50 {tick['p50_us']:.0f}us  p99 {tick['p99_us']:.0f}us  max {tick['max_us']:.0f}us "
+          f"(budget {1e6 / host.tick_rate:.0f}us)")
+    for match in host.matches[:3]:
+        places = ", ".join(f"{player.name} #{player.place} sent {player.lines_sent}"
+                           for player in match.standings()[:5])
+        print(f"match {match.number}: {places}")
+
+
+if __name__ == '__main__':
+    main()
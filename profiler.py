@@ -0,0 +1,76 @@
+import json
+import time
+from collections import deque
+from typing import Dict, List, Optional, TextIO, Sequence
+
+"""
+Phase timings for the game loop. Instrumented code keeps a profiler reference that is None when profiling is off,
+so a disabled phase costs one "is not None" check. Times are measured with time.perf_counter_ns and kept in a
+rolling window per phase, percentiles are calculated from the window when asked.
+
+Example:
+    profiler = Profiler(output=open("profile.jsonl", "w"))
+    engine.profiler = profiler
+    ...
+    profiler.export(frame=engine.frames)
+"""
+
+
+class Profiler:
+    def __init__(self, window: int = 600, output: Optional[TextIO] = None):
+        """
+        :param window: int, newest samples kept for every phase
+        :param output: text file for export() as JSON lines
+        """
+        self.window = window
+        self.output = output
+        self.samples: Dict[str, deque] = {}
+        # All time counts, the window only has the newest ones
+        self.counts: Dict[str, int] = {}
+
+    def add(self, phase: str, nanoseconds: int) -> None:
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples[phase] = deque(maxlen=self.window)
+            self.counts[phase] = 0
+
+        samples.append(nanoseconds)
+        self.counts[phase] += 1
+
+    def percentiles(self, phase: str, percents: Sequence[float] = (50, 95, 99)) -> List[float]:
+        """
+        Nearest rank percentiles of the window
+        :param phase: str
+        :param percents: percentiles to calculate
+        :return: list of microseconds, empty if the phase has no samples
+        """
+        # Copy is made in C, so it is safe while another thread adds samples
+        values = sorted(self.samples.get(phase, ()))
+        if not values:
+            return []
+
+        return [values[max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))] / 1000
+                for percent in percents]
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for phase in sorted(self.samples):
+            p50, p95, p99, p100 = self.percentiles(phase, (50, 95, 99, 100))
+            result[phase] = {"count": self.counts[phase], "p50_us": p50, "p95_us": p95, "p99_us": p99, "max_us": p100}
+
+        return result
+
+    def export(self, **fields) -> None:
+        """
+        Write the summary as one JSON line to output, extra fields (e.g. frame, fps) are added to the line
+        """
+        if self.output is None:
+            return
+
+        line = {"time": time.time(), **fields, "phases": self.summary()}
+        self.output.write(json.dumps(line) + "\n")
+        self.output.flush()
+
+    def clear(self) -> None:
+        self.samples.clear()
+        self.counts.clear()
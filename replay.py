@@ -0,0 +1,314 @@
+import json
+import mmap
+import struct
+from typing import List, Tuple, Optional, Iterator
+from engine import Engine, SNAPSHOT_FIELDS, ROWS, COLS
+
+"""
+Recording and headless replay of games. A game is fully defined by the engine seed, board size and the key_buffer
+batches with their frame numbers, so replaying them gives the same final state as the original run.
+
+Binary replay file (ReplayWriter / ReplayFile):
+
+    header    MAGIC, version, seed, height, width
+    records   input record:    INPUT_RECORD, frame delta (varint), key count, key codes
+              keyframe record: KEYFRAME_RECORD, length, Engine.snapshot()
+    index     (frame, record offset) of every keyframe
+    footer    index offset, keyframe count, frames, keyframe interval, MAGIC
+
+Frame deltas count from the previous record, keyframes reset the count to their own frame. The file is read
+through mmap and only the footer is parsed when it is opened, seeking finds the nearest keyframe from the index
+with binary search and replays only the inputs after it.
+"""
+
+MAGIC = b"TREP"
+VERSION = 1
+HEADER = struct.Struct("!4sHQHH")
+FOOTER = struct.Struct("!QIII4s")
+INDEX_ENTRY = struct.Struct("!IQ")
+KEYFRAME_LENGTH = struct.Struct("!I")
+
+INPUT_RECORD = 1
+KEYFRAME_RECORD = 2
+
+# One byte per key in input records
+KEY_CODES = {"left": 0, "right": 1, "rotate": 2, "down": 3, "hard_drop": 4}
+CODE_KEYS = {code: key for key, code in KEY_CODES.items()}
+
+# Frames between keyframes, a seek replays at most this many frames
+KEYFRAME_INTERVAL = 600
+
+
+class Recording:
+    def __init__(self, seed: int, inputs: List[Tuple[int, Tuple[str, ...]]], frames: int, width: int = COLS,
+                 height: int = ROWS):
+        """
+        :param seed: int, seed of the recorded engine
+        :param inputs: list of (frame, keys) where keys were in key_buffer when update ran on that frame
+        :param frames: int, replay runs every frame before this one
+        :param width: int, board width of the recorded engine
+        :param height: int, board height of the recorded engine
+        """
+        self.seed = seed
+        self.inputs = inputs
+        self.frames = frames
+        self.width = width
+        self.height = height
+
+    def engine(self) -> Engine:
+        # Fresh engine the recording starts from
+        return Engine(self.seed, width=self.width, height=self.height)
+
+    @classmethod
+    def from_engine(cls, engine: Engine) -> "Recording":
+        if engine.input_log is None:
+            raise ValueError("Engine was not created with record_inputs=True")
+
+        # Update that ended the game does not increase the frame counter, but it has to be replayed too
+        frames = engine.frames + 1 if engine.game_end else engine.frames
+        return cls(engine.seed, list(engine.input_log), frames, engine.width, engine.height)
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump({"seed": self.seed, "frames": self.frames, "width": self.width, "height": self.height,
+                       "inputs": self.inputs}, file)
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path) as file:
+            data = json.load(file)
+
+        inputs = [(frame, tuple(keys)) for frame, keys in data["inputs"]]
+        # Recordings from before board sizes were configurable are on the default board
+        return cls(data["seed"], inputs, data["frames"], data.get("width", COLS), data.get("height", ROWS))
+
+
+def replay(recording: Recording, until_frame: Optional[int] = None) -> Engine:
+    """
+    Play the recording in headless engine at full speed, frames without inputs are skipped with Engine.step
+    :param recording: Recording
+    :param until_frame: int, stop at this frame instead of the end of recording
+    :return: Engine in the state the recorded engine was at that frame
+    """
+    if until_frame is None:
+        until_frame = recording.frames
+
+    engine = recording.engine()
+    for frame, keys in recording.inputs:
+        if frame >= until_frame:
+            break
+
+        engine.step(frame - engine.frames)
+        # Same keys on the same frame as in the original game
+        engine.key_buffer.extend(keys)
+        engine.update()
+
+    engine.step(until_frame - engine.frames)
+    return engine
+
+
+def write_varint(value: int) -> bytes:
+    # Unsigned LEB128, small frame deltas take one byte
+    parts = bytearray()
+    while value >= 0x80:
+        parts.append(value & 0x7F | 0x80)
+        value >>= 7
+
+    parts.append(value)
+    return bytes(parts)
+
+
+def read_varint(buffer, offset: int) -> Tuple[int, int]:
+    """
+    :return: (value, offset after the value)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+
+        shift += 7
+
+
+class ReplayWriter:
+    """
+    Writes a binary replay file, records are appended as the game goes and the index is written on close
+    """
+
+    def __init__(self, path: str, seed: int, keyframe_interval: int = KEYFRAME_INTERVAL, width: int = COLS,
+                 height: int = ROWS):
+        self.file = open(path, "wb")
+        self.seed = seed
+        self.keyframe_interval = keyframe_interval
+        # (frame, offset) of every keyframe
+        self.index: List[Tuple[int, int]] = []
+        # Frame input deltas count from
+        self.base_frame = 0
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, height, width))
+
+    def write_inputs(self, frame: int, keys) -> None:
+        """
+        :param frame: int, frame of the update that got the keys, not before the last record
+        :param keys: keys that were in key_buffer
+        """
+        self.file.write(bytes([INPUT_RECORD]) + write_varint(frame - self.base_frame) + bytes([len(keys)])
+                        + bytes(KEY_CODES[key] for key in keys))
+        self.base_frame = frame
+
+    def write_keyframe(self, engine: Engine) -> None:
+        # Engine has to be between updates, inputs of its current frame are written after this
+        data = engine.snapshot()
+        self.index.append((engine.frames, self.file.tell()))
+        self.file.write(bytes([KEYFRAME_RECORD]) + KEYFRAME_LENGTH.pack(len(data)) + data)
+        self.base_frame = engine.frames
+
+    def close(self, frames: int) -> None:
+        """
+        Write the index and footer
+        :param frames: int, replay runs every frame before this one, same as Recording.frames
+        """
+        index_offset = self.file.tell()
+        for frame, offset in self.index:
+            self.file.write(INDEX_ENTRY.pack(frame, offset))
+
+        self.file.write(FOOTER.pack(index_offset, len(self.index), frames, self.keyframe_interval, MAGIC))
+        self.file.close()
+
+
+def save_binary(recording: Recording, path: str, keyframe_interval: int = KEYFRAME_INTERVAL) -> None:
+    """
+    Write recording as binary replay, the game is simulated headless to get the keyframes
+    """
+    writer = ReplayWriter(path, recording.seed, keyframe_interval, recording.width, recording.height)
+    engine = recording.engine()
+    next_keyframe = keyframe_interval
+    # Fake input at the end writes the keyframes after the last real input
+    for frame, keys in recording.inputs + [(recording.frames, None)]:
+        # Keyframe is the state before the update of its frame, so it goes before the inputs of that frame
+        while next_keyframe <= frame and not engine.game_end:
+            engine.step(next_keyframe - engine.frames)
+            if engine.frames == next_keyframe:
+                writer.write_keyframe(engine)
+
+            next_keyframe += keyframe_interval
+
+        if keys is None:
+            break
+
+        engine.step(frame - engine.frames)
+        engine.key_buffer.extend(keys)
+        engine.update()
+        writer.write_inputs(frame, keys)
+
+    writer.close(recording.frames)
+
+
+class ReplayFile:
+    """
+    Binary replay opened with mmap, nothing is read before it is needed so big files open right away
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version = HEADER.unpack_from(self.data, 0)[:2]
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a replay file")
+        if self.version != VERSION:
+            raise ValueError(f"Replay version {self.version} is not supported")
+
+        _, _, self.seed, self.height, self.width = HEADER.unpack_from(self.data, 0)
+
+        (self.index_offset, self.keyframe_count, self.frames, self.keyframe_interval,
+         magic) = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} has no footer, the writer was not closed")
+
+    def keyframe(self, number: int) -> Tuple[int, int]:
+        # (frame, offset) of a keyframe, read from the index in the file
+        return INDEX_ENTRY.unpack_from(self.data, self.index_offset + number * INDEX_ENTRY.size)
+
+    def find_keyframe(self, frame: int) -> Optional[int]:
+        """
+        Binary search for the last keyframe at or before the frame
+        :return: int, keyframe number, None if the first keyframe is after the frame
+        """
+        low, high = 0, self.keyframe_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.keyframe(middle)[0] <= frame:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low - 1 if low > 0 else None
+
+    def records(self, offset: int = HEADER.size, base_frame: int = 0) -> Iterator[Tuple[int, Tuple[str, ...]]]:
+        """
+        Input batches from the offset to the end of records, keyframes are skipped
+        :return: iterator of (frame, keys)
+        """
+        data = self.data
+        frame = base_frame
+        while offset < self.index_offset:
+            record = data[offset]
+            if record == INPUT_RECORD:
+                delta, offset = read_varint(data, offset + 1)
+                count = data[offset]
+                frame += delta
+                yield frame, tuple(CODE_KEYS[code] for code in data[offset + 1:offset + 1 + count])
+                offset += 1 + count
+            elif record == KEYFRAME_RECORD:
+                length, = KEYFRAME_LENGTH.unpack_from(data, offset + 1)
+                offset += 1 + KEYFRAME_LENGTH.size
+                frame = SNAPSHOT_FIELDS.unpack_from(data, offset)[1]
+                offset += length
+            else:
+                raise ValueError(f"Unknown record {record} at {offset}")
+
+    def seek(self, frame: int) -> Engine:
+        """
+        Engine in the state the recorded engine was at the frame, only the frames after the nearest keyframe
+        are simulated
+        :param frame: int
+        :return: Engine
+        """
+        frame = min(frame, self.frames)
+        number = self.find_keyframe(frame)
+        if number is None:
+            engine = Engine(self.seed, width=self.width, height=self.height)
+            inputs = self.records()
+        else:
+            keyframe_frame, offset = self.keyframe(number)
+            engine = Engine(self.seed, width=self.width, height=self.height)
+            engine.restore(self.data, offset + 1 + KEYFRAME_LENGTH.size)
+            inputs = self.records(offset, keyframe_frame)
+
+        for input_frame, keys in inputs:
+            if input_frame >= frame:
+                break
+
+            engine.step(input_frame - engine.frames)
+            engine.key_buffer.extend(keys)
+            engine.update()
+
+        engine.step(frame - engine.frames)
+        return engine
+
+    def recording(self) -> Recording:
+        return Recording(self.seed, list(self.records()), self.frames, self.width, self.height)
+
+    def close(self) -> None:
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,195 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import time
+from multiprocessing import Pool
+from typing import List, Callable, Dict
+from engine import Engine, ROWS, COLS
+from search import best_placement
+from cache import LRUCache
+
+"""
+Headless Monte Carlo runner: plays many games on all cores and reports aggregated results
+
+Example:
+    python runner.py --games 10000 --policy random --seed 1
+    python runner.py --games 100 --policy search --width 20 --height 40
+"""
+
+# Policy gets the engine and its own random generator and returns the keys to press before next gravity step
+Policy = Callable[[Engine, random.Random], List[str]]
+
+
+def idle_policy(engine: Engine, rng: random.Random) -> List[str]:
+    # Never press anything, shapes fall where they spawn
+    return []
+
+
+def random_policy(engine: Engine, rng: random.Random) -> List[str]:
+    return [rng.choice(["left", "right", "rotate", "down"])]
+
+
+# Search and evaluation results of the search policies, one cache per worker process
+search_cache = LRUCache(1 << 16)
+
+
+def search_policy(engine: Engine, rng: random.Random, lookahead: bool = False) -> List[str]:
+    # Move the falling shape to the placement with the best board and drop it
+    if engine.last_spawned_object_id is None:
+        return []
+
+    next_shape = engine.next_shape[0] if lookahead else None
+    placement = best_placement(engine.bitboard, engine.last_spawned_shape_id, engine.last_spawned_rotation,
+                               engine.last_spawned_object_row, engine.last_spawned_object_col, next_shape,
+                               cache=search_cache, hash_value=engine.board_hash, width=engine.width)
+    if placement is None:
+        return []
+
+    return placement.keys() + ["hard_drop"]
+
+
+def lookahead_policy(engine: Engine, rng: random.Random) -> List[str]:
+    return search_policy(engine, rng, lookahead=True)
+
+
+POLICIES: Dict[str, Policy] = {
+    "idle": idle_policy,
+    "random": random_policy,
+    "search": search_policy,
+    "lookahead": lookahead_policy,
+}
+
+
+def load_policy(name: str) -> Policy:
+    """
+    Find policy by name from POLICIES or import it with "module:function"
+    :param name: str
+    :return: policy function
+    """
+    if name in POLICIES:
+        return POLICIES[name]
+
+    if ":" not in name:
+        raise ValueError(f"Unknown policy {name}, use one of {list(POLICIES)} or module:function")
+
+    module_name, function_name = name.split(":", 1)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def play_game(task) -> dict:
+    """
+    Play one headless game, runs inside worker process
+    :param task: (game index, seed, policy name, max frames, board width, board height)
+    :return: dict with the results of the game
+    """
+    game, seed, policy_name, max_frames, width, height = task
+    policy = load_policy(policy_name)
+
+    # Own stream for the policy so it does not follow the engine sequence
+    policy_rng = random.Random(f"policy {seed}")
+    engine = Engine(seed, width=width, height=height)
+
+    start = time.perf_counter()
+    while not engine.game_end and engine.frames < max_frames:
+        engine.key_buffer.extend(policy(engine, policy_rng))
+        # Policy acts once per gravity step
+        engine.step(min(engine.speed, max_frames - engine.frames))
+
+    return {
+        "game": game,
+        "seed": seed,
+        "score": engine.score,
+        "level": engine.level,
+        "lines": engine.total_tetris_rows,
+        "pieces": engine.pieces_locked,
+        "frames": engine.frames,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    # Nearest rank percentile, values have to be sorted
+    index = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def aggregate(results: List[dict], seconds: float) -> dict:
+    summary = {"games": len(results), "seconds": seconds, "games_per_sec": len(results) / seconds,
+               "frames_per_sec": sum(result["frames"] for result in results) / seconds}
+
+    for key in ["score", "level", "lines", "pieces", "frames"]:
+        values = sorted(result[key] for result in results)
+        summary[key] = {
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p99": percentile(values, 99),
+        }
+
+    return summary
+
+
+def run(games: int, policy: str, seed: int, workers: int, max_frames: int, output=None, width: int = COLS,
+        height: int = ROWS) -> dict:
+    """
+    Play games on a process pool, results are streamed back as soon as each game ends
+    :param games: int, amount of games
+    :param policy: str, policy name
+    :param seed: int, game n uses seed + n
+    :param workers: int, amount of processes
+    :param max_frames: int, stop game after this many frames
+    :param output: file for per game results as JSON lines
+    :param width: int, board width
+    :param height: int, board height
+    :return: dict of aggregated results
+    """
+    # Fail early instead of in every worker
+    load_policy(policy)
+    Engine(seed, width=width, height=height)
+    Engine(seed + games - 1, width=width, height=height)
+
+    tasks = [(game, seed + game, policy, max_frames, width, height) for game in range(games)]
+    # Small chunks keep results streaming while not paying process overhead for every game
+    chunk_size = max(1, games // (workers * 16))
+    results = []
+
+    start = time.perf_counter()
+    with Pool(workers) as pool:
+        for result in pool.imap_unordered(play_game, tasks, chunksize=chunk_size):
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+
+    return aggregate(results, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play headless games on all cores and report results")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--policy", default="random", help=f"one of {list(POLICIES)} or module:function")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game, game n uses seed + n")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--max-frames", type=int, default=1_000_000)
+    parser.add_argument("--width", type=int, default=COLS, help="board width")
+    parser.add_argument("--height", type=int, default=ROWS, help="board height")
+    parser.add_argument("--output", help="write per game results to this file as JSON lines")
+    args = parser.parse_args()
+
+    output = open(args.output, "w") if args.output else None
+    try:
+        summary = run(args.games, args.policy, args.seed, args.workers, args.max_frames, output, args.width,
+                      args.height)
+    finally:
+        if output is not None:
+            output.close()
+
+    print(f"{summary['games']} games in {summary['seconds']:.2f}s, {summary['games_per_sec']:.1f} games/sec, "
+          f"{summary['frames_per_sec']:.0f} frames/sec")
+    for key in ["score", "level", "lines", "pieces", "frames"]:
+        stats = summary[key]
+        print(f"{key:>7}: mean {stats['mean']:.1f}  p50 {stats['p50']}  p99 {stats['p99']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+from typing import List, Optional, Tuple, Callable
+from engine import Engine, ROTATIONS, KICKS, ROWS, COLS, ZobristKeys, zobrist_keys
+from cache import LRUCache, MISSING
+
+"""
+Placement search for bots. Finds every resting place the falling shape can reach with left, right, rotate
+and down keys, without touching Engine.state. Boards are Engine.bitboard style lists of row bits and shapes
+are precomputed row masks, so a fit test is a few ANDs. Masks are made once per board width, board height is
+the length of the board list.
+
+Search and evaluation results can be kept in an LRUCache keyed on the Zobrist hash of the board,
+positions that come up again in lookahead searches are then only a lookup.
+
+Example:
+    placements = search_engine(engine)
+    best = max(placements, key=lambda placement: evaluate(placement.board))
+    engine.key_buffer.extend(best.keys() + ["hard_drop"])
+"""
+
+# Box cols can be left of the board, shapes don't always start on the first col of their box.
+# Masks have room for moves and kicks of 2 cols past the walls
+MIN_COL = -5
+# Box rows start above the board, spawn row is -1 and kicks move up by one
+MIN_ROW = -3
+
+# Spawn row of the rotation box, col is random in the engine so lookahead uses Geometry.spawn_col
+SPAWN_ROW = -1
+
+
+def build_masks(cells: Tuple[Tuple[int, int], ...], width: int = COLS) -> List[Optional[Tuple[Tuple[int, int], ...]]]:
+    """
+    Row masks of the shape for every box col
+    :param cells: (row, col) offsets of one rotation
+    :param width: int, board width
+    :return: list indexed by col - MIN_COL of ((d_row, row bits), ...), None where shape is outside the walls
+    """
+    masks = []
+    for col in range(MIN_COL, width + 3):
+        rows = {}
+        for d_row, d_col in cells:
+            if not 0 <= col + d_col < width:
+                rows = None
+                break
+
+            rows[d_row] = rows.get(d_row, 0) | 1 << (col + d_col)
+
+        masks.append(None if rows is None else tuple(sorted(rows.items())))
+
+    return masks
+
+
+class Geometry:
+    """
+    Everything search needs to know about one board size: shape masks, state encoding and Zobrist keys
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.full_row = (1 << width) - 1
+        self.col_span = width + 3 - MIN_COL
+        self.row_span = height - MIN_ROW
+        self.spawn_col = (width - 4) // 2
+        # shape_masks[shape_id][rotation][col - MIN_COL]
+        self.shape_masks = [[build_masks(cells, width) for cells in rotations] for rotations in ROTATIONS]
+        self.zobrist: ZobristKeys = zobrist_keys(height, width)
+
+    def encode(self, rotation: int, row: int, col: int) -> int:
+        return (rotation * self.row_span + row - MIN_ROW) * self.col_span + col - MIN_COL
+
+    def decode(self, state: int) -> Tuple[int, int, int]:
+        rest, col = divmod(state, self.col_span)
+        rotation, row = divmod(rest, self.row_span)
+        return rotation, row + MIN_ROW, col + MIN_COL
+
+
+_geometries = {}
+
+
+def geometry(width: int = COLS, height: int = ROWS) -> Geometry:
+    # Made once per board size
+    result = _geometries.get((width, height))
+    if result is None:
+        result = _geometries[(width, height)] = Geometry(width, height)
+
+    return result
+
+
+# Key to move the shape between two search states, index of the move in search
+MOVE_KEYS = ["left", "right", "rotate", "down"]
+
+
+def fits(board: List[int], masks, row: int) -> bool:
+    # Same as Engine.shape_fits with masks from Geometry.shape_masks
+    if masks is None:
+        return False
+
+    for d_row, mask in masks:
+        board_row = row + d_row
+        if board_row < 0 or board_row >= len(board) or board[board_row] & mask:
+            return False
+
+    return True
+
+
+class Placement:
+    def __init__(self, shape_id: int, rotation: int, row: int, col: int, board: List[int], lines: int,
+                 parents: dict, state: int, board_hash: Optional[int] = None):
+        """
+        :param shape_id: int
+        :param rotation: int
+        :param row: int, top row of the rotation box when resting
+        :param col: int, left col of the rotation box
+        :param board: list of row bits after the shape is locked and full rows are cleared
+        :param lines: int, amount of rows cleared
+        :param parents: search tree, used to find the keys
+        :param state: int, search state of this placement
+        :param board_hash: int, Zobrist hash of board, None when the search was not given a hash
+        """
+        self.shape_id = shape_id
+        self.rotation = rotation
+        self.row = row
+        self.col = col
+        self.board = board
+        self.lines = lines
+        self.parents = parents
+        self.state = state
+        self.board_hash = board_hash
+
+    def keys(self) -> List[str]:
+        """
+        Keys that move the shape from the search start to this placement, add "hard_drop" or "down" to lock it
+        :return: list of keys for Engine.key_buffer
+        """
+        keys = []
+        state = self.state
+        while True:
+            parent, move = self.parents[state]
+            if parent is None:
+                break
+
+            keys.append(MOVE_KEYS[move])
+            state = parent
+
+        keys.reverse()
+        return keys
+
+    def __repr__(self):
+        return f"Placement(shape {self.shape_id}, rotation {self.rotation}, row {self.row}, col {self.col}, " \
+               f"lines {self.lines})"
+
+
+def lock(board: List[int], masks, row: int, full_row: int = (1 << COLS) - 1) -> Tuple[List[int], int]:
+    """
+    Write the shape to a copy of the board and clear full rows the way the engine does. Engine.tetris_move
+    moves rows 1 to the lowest cleared row down once per cleared row and keeps row 0, so rows between split
+    clears are lost and row 0 is copied down. This is the board after the engine has finished moving the rows
+    :param full_row: int, row bits of a full row of the board width
+    :return: (new board, amount of cleared rows)
+    """
+    new_board = board.copy()
+    cleared = []
+    for d_row, mask in masks:
+        new_board[row + d_row] |= mask
+        if new_board[row + d_row] == full_row:
+            cleared.append(row + d_row)
+
+    lines = 0
+    while cleared:
+        lines += len(cleared)
+        for cleared_row in cleared:
+            new_board[cleared_row] = 0
+
+        # After one move per cleared row, row r has what was on row r - count, or row 0 when that is above the board
+        count = len(cleared)
+        bottom_row = max(cleared)
+        new_board[1:bottom_row + 1] = [new_board[max(0, moved_row - count)] for moved_row in range(1, bottom_row + 1)]
+
+        # Cascading tetris, same as the engine checks the moved rows
+        cleared = [moved_row for moved_row in range(1, bottom_row + 1) if new_board[moved_row] == full_row]
+
+    return new_board, lines
+
+
+def search(board: List[int], shape_id: int, rotation: int = 0, row: int = SPAWN_ROW, col: Optional[int] = None,
+           cache: Optional[LRUCache] = None, hash_value: Optional[int] = None, width: int = COLS) -> List[Placement]:
+    """
+    Breadth first search over (rotation, row, col) of the shape with the engine moves, rotation uses
+    the engine kicks. Every state where the shape can not move down is a placement, placements covering
+    the same cells are returned once
+    :param board: list of row bits, e.g. Engine.bitboard
+    :param shape_id: int, index in Engine.all_shapes
+    :param rotation: int, start rotation
+    :param row: int, start row of the rotation box
+    :param col: int, start col of the rotation box, default is the middle spawn col
+    :param cache: LRUCache, placements of positions searched before are taken from here
+    :param hash_value: int, Zobrist hash of board (e.g. Engine.board_hash), calculated when cache is given without it
+    :param width: int, board width, height is the length of board
+    :return: list of placements, empty if the shape does not fit at the start. Don't change them, they can be cached
+    """
+    board_geometry = geometry(width, len(board))
+    if col is None:
+        col = board_geometry.spawn_col
+
+    zobrist = board_geometry.zobrist
+    if cache is not None:
+        if hash_value is None:
+            hash_value = zobrist.board_hash(board)
+
+        # Same as Engine.position_hash() for the start position
+        key = ("search", hash_value ^ zobrist.piece_key(shape_id, rotation, row, col))
+        placements = cache.get(key)
+        if placements is MISSING:
+            placements = search(board, shape_id, rotation, row, col, None, hash_value, width)
+            cache.put(key, placements)
+
+        return placements
+
+    shape_masks = board_geometry.shape_masks[shape_id]
+    col_span = board_geometry.col_span
+    full_row = board_geometry.full_row
+    encode, decode = board_geometry.encode, board_geometry.decode
+    kicks = KICKS[shape_id]
+    if not fits(board, shape_masks[rotation][col - MIN_COL], row):
+        return []
+
+    start = encode(rotation, row, col)
+    # state: (parent state, move index), also works as the visited set
+    parents = {start: (None, None)}
+    queue = [start]
+    placements = []
+    seen_cells = set()
+
+    for state in queue:
+        rotation, row, col = decode(state)
+        masks = shape_masks[rotation][col - MIN_COL]
+
+        # left and right
+        for move, new_col in ((0, col - 1), (1, col + 1)):
+            new_state = state + new_col - col
+            if new_state not in parents and fits(board, shape_masks[rotation][new_col - MIN_COL], row):
+                parents[new_state] = (state, move)
+                queue.append(new_state)
+
+        # Rotate, first kick that fits wins like in Engine.manual_rotate
+        new_rotation = (rotation + 1) % 4
+        for kick_row, kick_col in kicks:
+            new_row, new_col = row + kick_row, col + kick_col
+            if fits(board, shape_masks[new_rotation][new_col - MIN_COL], new_row):
+                new_state = encode(new_rotation, new_row, new_col)
+                if new_state not in parents:
+                    parents[new_state] = (state, 2)
+                    queue.append(new_state)
+                break
+
+        # Down, or rest here
+        if fits(board, masks, row + 1):
+            new_state = state + col_span
+            if new_state not in parents:
+                parents[new_state] = (state, 3)
+                queue.append(new_state)
+        else:
+            cells = tuple((row + d_row, mask) for d_row, mask in masks)
+            if cells in seen_cells:
+                continue
+
+            seen_cells.add(cells)
+            new_board, lines = lock(board, masks, row, full_row)
+            new_hash = None
+            if hash_value is not None:
+                if lines == 0:
+                    # Only the shape cells were added
+                    new_hash = hash_value
+                    for board_row, mask in cells:
+                        new_hash ^= zobrist.row_hash(board_row, mask)
+                else:
+                    new_hash = zobrist.board_hash(new_board)
+
+            placements.append(Placement(shape_id, rotation, row, col, new_board, lines, parents, state, new_hash))
+
+    return placements
+
+
+def search_engine(engine: Engine, cache: Optional[LRUCache] = None) -> List[Placement]:
+    """
+    Placements of the falling shape of the engine from where it is now
+    :param engine: Engine
+    :param cache: LRUCache, the board hash is taken from the engine
+    :return: list of placements, empty if there is no falling shape
+    """
+    if engine.last_spawned_object_id is None:
+        return []
+
+    return search(engine.bitboard, engine.last_spawned_shape_id, engine.last_spawned_rotation,
+                  engine.last_spawned_object_row, engine.last_spawned_object_col, cache, engine.board_hash, engine.width)
+
+
+def evaluate(board: List[int], width: int = COLS) -> float:
+    """
+    Simple board score, higher is better: punishes height, holes and uneven columns
+    :param board: list of row bits
+    :param width: int, board width
+    :return: float
+    """
+    heights = [0] * width
+    covered = 0
+    holes = 0
+    aggregate_height = 0
+    for row, bits in enumerate(board):
+        # Columns that get their top cell on this row
+        new = bits & ~covered
+        while new:
+            low_bit = new & -new
+            heights[low_bit.bit_length() - 1] = len(board) - row
+            new ^= low_bit
+
+        covered |= bits
+        holes += (covered & ~bits).bit_count()
+        aggregate_height += covered.bit_count()
+
+    bumpiness = sum(abs(heights[col] - heights[col + 1]) for col in range(width - 1))
+    return -0.51 * aggregate_height - 3.5 * holes - 0.18 * bumpiness - 2.0 * max(heights)
+
+
+def evaluate_placement(placement: Placement, evaluate: Callable[[List[int], int], float] = evaluate,
+                       cache: Optional[LRUCache] = None, width: int = COLS) -> float:
+    # Cleared lines plus board evaluation, boards seen before are taken from the cache
+    if cache is None or placement.board_hash is None:
+        return 0.76 * placement.lines + evaluate(placement.board, width)
+
+    key = ("evaluate", evaluate, placement.board_hash)
+    value = cache.get(key)
+    if value is MISSING:
+        value = evaluate(placement.board, width)
+        cache.put(key, value)
+
+    return 0.76 * placement.lines + value
+
+
+def lookahead_value(board: List[int], shape_id: int, evaluate: Callable[[List[int], int], float] = evaluate,
+                    cache: Optional[LRUCache] = None, hash_value: Optional[int] = None, width: int = COLS) -> float:
+    """
+    Value of the best placement of the shape from the spawn position
+    :return: float, -inf if the shape does not fit (game would end)
+    """
+    if cache is not None and hash_value is not None:
+        key = ("lookahead", evaluate, hash_value, shape_id)
+        value = cache.get(key)
+        if value is MISSING:
+            value = lookahead_value(board, shape_id, evaluate, width=width)
+            cache.put(key, value)
+
+        return value
+
+    # Second level boards rarely come up again, so they are not cached one by one
+    return max((0.76 * placement.lines + evaluate(placement.board, width)
+                for placement in search(board, shape_id, width=width)), default=float("-inf"))
+
+
+def best_placement(board: List[int], shape_id: int, rotation: int = 0, row: int = SPAWN_ROW,
+                   col: Optional[int] = None, next_shape: Optional[int] = None,
+                   evaluate: Callable[[List[int], int], float] = evaluate, cache: Optional[LRUCache] = None,
+                   hash_value: Optional[int] = None, width: int = COLS) -> Optional[Placement]:
+    """
+    Placement with the best evaluation, with next_shape the placement is rated by the best board after
+    placing the next shape too (next shape starts from the spawn position)
+    :param evaluate: function(board, width) giving the value of a board
+    :param cache: LRUCache for search, evaluation and lookahead results
+    :param hash_value: int, Zobrist hash of board, e.g. Engine.board_hash
+    :param width: int, board width
+    :return: Placement, None if nothing fits
+    """
+    best, best_value = None, None
+    for placement in search(board, shape_id, rotation, row, col, cache, hash_value, width):
+        if next_shape is None:
+            value = evaluate_placement(placement, evaluate, cache, width)
+        else:
+            value = 0.76 * placement.lines + lookahead_value(placement.board, next_shape, evaluate, cache,
+                                                             placement.board_hash, width)
+
+        if best_value is None or value > best_value:
+            best, best_value = placement, value
+
+    return best
@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import random
+import struct
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+from engine import Engine, ROWS, COLS
+from terminal import TerminalRender, CLEAR_SCREEN, cell_values, engine_stats, engine_next
+
+"""
+Spectator server: headless games are streamed to any number of viewers over TCP or a Unix socket.
+Viewers get a keyframe when they join and after that only deltas (changed cells, score, level, next shape).
+Every viewer has a bounded queue, a viewer that can not keep up is skipped forward to a keyframe of the
+newest state instead of buffering without limit.
+
+Wire format: every message is a 4-byte big endian length followed by the payload. Payload starts with HEADER
+(type, frame, score, level, lines, next shape, next color, game end). Keyframe continues with rows, cols and
+every cell value, delta with the amount of changes and (cell index, value) for each of them. Cell values are
+the frame buffer values of terminal.py. Viewer starts by sending the game name and a newline.
+
+Example:
+    python spectator.py serve --games 4 --policy search --port 8765
+    python spectator.py watch --game 0 --port 8765
+"""
+
+KEYFRAME = 1
+DELTA = 2
+
+LENGTH = struct.Struct("!I")
+HEADER = struct.Struct("!BIQHIBBB")
+SIZE = struct.Struct("!HH")
+COUNT = struct.Struct("!H")
+CHANGE = struct.Struct("!HB")
+# Next shape id when there is none yet
+NO_SHAPE = 255
+
+# (cells, (score, level, lines), (next shape id, color) or None, game end, frame)
+GameState = Tuple[List[int], Tuple[int, int, int], Optional[Tuple[int, int]], bool, int]
+
+
+def encode_header(kind: int, state: GameState) -> bytes:
+    _, stats, next_shape, game_end, frame = state
+    shape_id, color = next_shape if next_shape is not None else (NO_SHAPE, 0)
+    return HEADER.pack(kind, frame, stats[0], stats[1], stats[2], shape_id, color, game_end)
+
+
+def encode_keyframe(state: GameState, rows: int = ROWS, cols: int = COLS) -> bytes:
+    payload = encode_header(KEYFRAME, state) + SIZE.pack(rows, cols) + bytes(state[0])
+    return LENGTH.pack(len(payload)) + payload
+
+
+def encode_delta(state: GameState, changes: List[Tuple[int, int]]) -> bytes:
+    parts = [encode_header(DELTA, state), COUNT.pack(len(changes))]
+    parts.extend(CHANGE.pack(index, value) for index, value in changes)
+    payload = b"".join(parts)
+    return LENGTH.pack(len(payload)) + payload
+
+
+class Subscriber:
+    def __init__(self, writer: asyncio.StreamWriter, max_queue: int):
+        self.writer = writer
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.sent = 0
+        # Times the queue was full and thrown away for a keyframe
+        self.skipped = 0
+
+    def push(self, message: bytes, stream: "GameStream") -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too slow, old messages are useless now. Keyframe of the newest state replaces them
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+            self.queue.put_nowait(stream.keyframe())
+            self.skipped += 1
+
+
+class GameStream:
+    """
+    Published state of one engine. State is only read in publish(), so the engine has to be
+    published after every update for the deltas to add up
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.subscribers: Set[Subscriber] = set()
+        # Last published state, None when nobody is watching
+        self.state: Optional[GameState] = None
+        self.keyframe_message: Optional[bytes] = None
+
+    def capture(self) -> GameState:
+        engine = self.engine
+        return cell_values(engine), engine_stats(engine), engine_next(engine), engine.game_end, engine.frames
+
+    def keyframe(self) -> bytes:
+        # Keyframe of the last published state, built once per publish
+        if self.state is None:
+            self.state = self.capture()
+
+        if self.keyframe_message is None:
+            self.keyframe_message = encode_keyframe(self.state, self.engine.height, self.engine.width)
+
+        return self.keyframe_message
+
+    def publish(self) -> None:
+        # Send what changed since last publish to every subscriber
+        if not self.subscribers:
+            self.state = None
+            self.keyframe_message = None
+            return
+
+        prev = self.state
+        state = self.capture()
+        changes = [(index, value) for index, (old, value) in enumerate(zip(prev[0], state[0])) if old != value]
+        if not changes and state[1:4] == prev[1:4]:
+            return
+
+        self.state = state
+        self.keyframe_message = None
+        message = encode_delta(state, changes)
+        for subscriber in self.subscribers:
+            subscriber.push(message, self)
+
+
+class SpectatorServer:
+    def __init__(self, max_queue: int = 64):
+        """
+        :param max_queue: int, messages buffered for every viewer before it is skipped forward
+        """
+        self.max_queue = max_queue
+        self.games: Dict[str, GameStream] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        # Running viewer connections, cancelled on close
+        self.connections: Set[asyncio.Task] = set()
+
+    def add_game(self, name: str, engine: Engine) -> GameStream:
+        stream = GameStream(engine)
+        self.games[name] = stream
+        return stream
+
+    def publish(self) -> None:
+        for stream in self.games.values():
+            stream.publish()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Viewer sends the game name, empty name means the first game
+        try:
+            name = (await reader.readline()).decode().strip()
+        except (ConnectionError, UnicodeDecodeError):
+            writer.close()
+            return
+
+        if name == "" and self.games:
+            name = next(iter(self.games))
+
+        stream = self.games.get(name)
+        if stream is None:
+            writer.close()
+            return
+
+        subscriber = Subscriber(writer, self.max_queue)
+        subscriber.push(stream.keyframe(), stream)
+        stream.subscribers.add(subscriber)
+        self.connections.add(asyncio.current_task())
+        try:
+            while True:
+                message = await subscriber.queue.get()
+                writer.write(message)
+                # Waits while the socket buffer is full, publish keeps filling the queue meanwhile
+                await writer.drain()
+                subscriber.sent += 1
+        except (ConnectionError, asyncio.CancelledError):
+            # Viewer left or server is closing
+            pass
+        finally:
+            stream.subscribers.discard(subscriber)
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, path: Optional[str] = None) -> None:
+        """
+        Listen for viewers on TCP or on a Unix socket when path is given
+        """
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+
+        connections = list(self.connections)
+        for connection in connections:
+            connection.cancel()
+
+        await asyncio.gather(*connections, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+
+
+async def run_game(server: SpectatorServer, name: str, seed: int, policy, tick_rate: float = 60,
+                   restart: bool = True, width: int = COLS, height: int = ROWS) -> None:
+    """
+    Play a game in real time and publish every frame, a new game is started when it ends
+    :param server: SpectatorServer
+    :param name: str, name viewers use to pick this game
+    :param seed: int, seed of the first game, next games count up from it
+    :param policy: runner policy, called once per gravity step
+    :param tick_rate: float, engine updates per second
+    :param restart: bool, start a new game when the game ends
+    :param width: int, board width
+    :param height: int, board height
+    """
+    loop = asyncio.get_running_loop()
+    stream = server.add_game(name, Engine(seed, width=width, height=height))
+    rng = random.Random(f"policy {seed}")
+    tick_time = 1 / tick_rate
+    next_tick = loop.time()
+    while True:
+        engine = stream.engine
+        if engine.game_end:
+            if not restart:
+                return
+
+            # Show the end for a moment before the next game
+            await asyncio.sleep(2)
+            seed += 1
+            stream.engine = Engine(seed, width=width, height=height)
+            next_tick = loop.time()
+            continue
+
+        if engine.frames % engine.speed == 0:
+            engine.key_buffer.extend(policy(engine, rng))
+
+        engine.update()
+        stream.publish()
+
+        next_tick += tick_time
+        delay = next_tick - loop.time()
+        if delay < -1:
+            # Far behind, don't try to catch up
+            next_tick = loop.time()
+
+        await asyncio.sleep(max(0.0, delay))
+
+
+class RemoteGame:
+    """
+    Game state rebuilt from the messages of the server
+    """
+
+    def __init__(self):
+        self.cells: Optional[List[int]] = None
+        self.rows = ROWS
+        self.cols = COLS
+        self.stats = (0, 0, 0)
+        self.next_shape: Optional[Tuple[int, int]] = None
+        self.game_end = False
+        self.frame = 0
+        self.keyframes = 0
+        self.deltas = 0
+
+    def apply(self, payload: bytes) -> bool:
+        """
+        :param payload: message without the length
+        :return: bool, False if the message could not be used (delta before the first keyframe)
+        """
+        kind, frame, score, level, lines, shape_id, color, game_end = HEADER.unpack_from(payload)
+        offset = HEADER.size
+        if kind == KEYFRAME:
+            self.rows, self.cols = SIZE.unpack_from(payload, offset)
+            offset += SIZE.size
+            self.cells = list(payload[offset:offset + self.rows * self.cols])
+            self.keyframes += 1
+        elif kind == DELTA:
+            if self.cells is None:
+                return False
+
+            count, = COUNT.unpack_from(payload, offset)
+            offset += COUNT.size
+            for index, value in CHANGE.iter_unpack(payload[offset:offset + count * CHANGE.size]):
+                self.cells[index] = value
+
+            self.deltas += 1
+        else:
+            return False
+
+        self.frame = frame
+        self.stats = (score, level, lines)
+        self.next_shape = None if shape_id == NO_SHAPE else (shape_id, color)
+        self.game_end = bool(game_end)
+        return True
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return await reader.readexactly(length)
+
+
+async def watch(game: str = "", host: str = "127.0.0.1", port: int = 8765, path: Optional[str] = None,
+                out=sys.stdout) -> RemoteGame:
+    """
+    Connect to a spectator server and draw the game with the terminal renderer until the connection closes
+    :return: RemoteGame, last state
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    writer.write(game.encode() + b"\n")
+    await writer.drain()
+
+    remote = RemoteGame()
+    renderer = TerminalRender(None, out)
+    renderer.start()
+    try:
+        while True:
+            if remote.apply(await read_message(reader)):
+                if (remote.cols, remote.rows) != (renderer.width, renderer.height):
+                    renderer.out.write(CLEAR_SCREEN)
+                    renderer.resize(remote.cols, remote.rows)
+
+                # Renderer keeps the list as the previous frame, so give it a copy
+                renderer.draw(renderer.render(list(remote.cells), remote.stats, remote.next_shape))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        renderer.close()
+        writer.close()
+
+    return remote
+
+
+async def serve(games: int, policy_name: str, seed: int, host: str, port: int, path: Optional[str],
+                max_queue: int, width: int = COLS, height: int = ROWS) -> None:
+    from runner import load_policy
+
+    policy = load_policy(policy_name)
+    server = SpectatorServer(max_queue)
+    await server.start(host, port, path)
+    print(f"serving {games} games on {path or f'{host}:{port}'}")
+    await asyncio.gather(*(run_game(server, str(game), seed + game * 1000, policy, width=width, height=height)
+                           for game in range(games)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream headless games to terminal viewers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="play games and stream them")
+    serve_parser.add_argument("--games", type=int, default=1)
+    serve_parser.add_argument("--policy", default="search", help="runner policy name or module:function")
+    serve_parser.add_argument("--seed", type=int, default=0)
+    serve_parser.add_argument("--max-queue", type=int, default=64, help="messages buffered per viewer")
+    serve_parser.add_argument("--width", type=int, default=COLS, help="board width")
+    serve_parser.add_argument("--height", type=int, default=ROWS, help="board height")
+
+    watch_parser = commands.add_parser("watch", help="draw a streamed game in the terminal")
+    watch_parser.add_argument("--game", default="", help="game name, default is the first game")
+
+    for command_parser in [serve_parser, watch_parser]:
+        command_parser.add_argument("--host", default="127.0.0.1")
+        command_parser.add_argument("--port", type=int, default=8765)
+        command_parser.add_argument("--unix", help="Unix socket path instead of TCP")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "serve":
+            asyncio.run(serve(args.games, args.policy, args.seed, args.host, args.port, args.unix, args.max_queue,
+                              args.width, args.height))
+        else:
+            asyncio.run(watch(args.game, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
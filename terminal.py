@@ -0,0 +1,283 @@
+import argparse
+import random
+import sys
+import time
+from typing import List, Optional, TextIO, Tuple
+from color import Colors
+from engine import Engine, PALETTE, ALL_SHAPES, ROWS, COLS
+
+"""
+ANSI terminal renderer, needs no pygame so headless games can be watched over SSH.
+Every frame is built into one string and only the cells that changed since last frame are written,
+the cursor is moved to them with positioning escapes.
+
+Example:
+    python terminal.py --seed 1 --policy random
+"""
+
+RESET = "\033[0m"
+HIDE_CURSOR = "\033[?25l"
+SHOW_CURSOR = "\033[?25h"
+CLEAR_SCREEN = "\033[2J"
+
+# Values in the frame buffer: palette index of the piece color or one of these. Palette 0 is not used by pieces
+EMPTY = 0
+GHOST = len(PALETTE)
+
+
+def build_cell_codes() -> List[str]:
+    # Escape sequence that selects the color of every frame buffer value, built once
+    color_dict = Colors().color_dict
+    codes = [color_dict[name][0] for name in PALETTE]
+    codes[EMPTY] = "\033[0;48;5;235m"
+    codes.append("\033[0;48;5;240m")
+    return codes
+
+
+CELL_CODES = build_cell_codes()
+
+
+def move_cursor(row: int, col: int) -> str:
+    # Escape sequence rows and cols start from 1
+    return f"\033[{row + 1};{col + 1}H"
+
+
+def cell_values(engine: Engine, ghost: bool = True) -> List[int]:
+    """
+    Frame buffer value of every cell including ghost and falling shape
+    :param engine: Engine
+    :param ghost: bool, add the ghost of the falling shape
+    :return: list of values row by row
+    """
+    colors = engine.pool.colors
+    cells = [colors[cell] if cell != 0 else EMPTY for row in engine.state for cell in row]
+
+    if engine.last_spawned_object_id is not None:
+        piece_cells = engine.piece_cells()
+        if ghost:
+            ghost_offset = engine.ghost_row() - engine.last_spawned_object_row
+            for row, col in piece_cells:
+                cells[(row + ghost_offset) * engine.width + col] = GHOST
+
+        color = colors[engine.last_spawned_object_id]
+        for row, col in piece_cells:
+            cells[row * engine.width + col] = color
+
+    return cells
+
+
+def engine_stats(engine: Engine) -> Tuple[int, int, int]:
+    # Numbers shown in the HUD
+    return engine.score, engine.level, engine.total_tetris_rows
+
+
+def engine_next(engine: Engine) -> Optional[Tuple[int, int]]:
+    # (shape id, palette index) of the next shape, None before the first spawn
+    if engine.next_shape is None:
+        return None
+
+    return engine.next_shape[0], engine.pool.colors[engine.next_object_id]
+
+
+class TerminalRender:
+    def __init__(self, engine: Optional[Engine], out: TextIO = sys.stdout, top: int = 1, left: int = 2,
+                 ghost: bool = True, width: Optional[int] = None, height: Optional[int] = None):
+        """
+        :param engine: Engine to draw, None when frames are drawn with render() from other source
+        :param out: text stream of the terminal
+        :param top: int, screen row of the top border
+        :param left: int, screen col of the left border
+        :param ghost: bool, show where the falling shape would land
+        :param width: int, board width, default is the width of the engine
+        :param height: int, board height, default is the height of the engine
+        """
+        self.engine = engine
+        self.out = out
+        self.top = top
+        self.left = left
+        self.ghost = ghost
+
+        # Cell values of the last written frame, None forces full redraw
+        self.prev_cells: Optional[List[int]] = None
+        self.prev_hud: Optional[tuple] = None
+        self.prev_next: Optional[tuple] = None
+
+        self.width = 0
+        self.height = 0
+        self.hud_col = 0
+        self.resize(width or (engine.width if engine is not None else COLS),
+                    height or (engine.height if engine is not None else ROWS))
+
+    def resize(self, width: int, height: int) -> None:
+        # Board size changed (e.g. first keyframe from a server), everything is drawn again
+        self.width = width
+        self.height = height
+        # HUD is on the right side of the board, cells are 2 characters wide
+        self.hud_col = self.left + 2 * width + 4
+        self.redraw_all()
+
+    def start(self) -> None:
+        self.out.write(HIDE_CURSOR + CLEAR_SCREEN)
+        self.redraw_all()
+
+    def close(self) -> None:
+        # Leave the cursor below the board
+        self.out.write(RESET + move_cursor(self.top + self.height + 2, 0) + SHOW_CURSOR)
+        self.out.flush()
+
+    def redraw_all(self) -> None:
+        self.prev_cells = None
+        self.prev_hud = None
+        self.prev_next = None
+
+    def cell_values(self) -> List[int]:
+        return cell_values(self.engine, self.ghost)
+
+    def border(self) -> str:
+        horizontal = "+" + "-" * 2 * self.width + "+"
+        parts = [RESET, move_cursor(self.top, self.left), horizontal]
+        for row in range(self.height):
+            parts.append(move_cursor(self.top + 1 + row, self.left) + "|")
+            parts.append(move_cursor(self.top + 1 + row, self.left + 1 + 2 * self.width) + "|")
+
+        parts.append(move_cursor(self.top + 1 + self.height, self.left) + horizontal)
+        return "".join(parts)
+
+    def board(self, cells: List[int]) -> str:
+        # Changed cells only, cursor is not moved between neighbour cells of the same row
+        prev_cells = self.prev_cells
+        width = self.width
+        parts = []
+        code = None
+        cursor = None
+        for index, value in enumerate(cells):
+            if prev_cells is not None and prev_cells[index] == value:
+                continue
+
+            if index != cursor:
+                row, col = divmod(index, width)
+                parts.append(move_cursor(self.top + 1 + row, self.left + 1 + 2 * col))
+
+            if value != code:
+                parts.append(CELL_CODES[value])
+                code = value
+
+            parts.append("  ")
+            # Cursor wraps to the border after the last col, next row needs a move
+            cursor = index + 1 if (index + 1) % width != 0 else None
+
+        if parts:
+            parts.append(RESET)
+
+        return "".join(parts)
+
+    def hud(self, stats: Tuple[int, int, int], next_shape: Optional[Tuple[int, int]]) -> str:
+        parts = []
+        if stats != self.prev_hud:
+            self.prev_hud = stats
+            # Erase to end of line so shorter numbers don't leave old digits behind
+            for line, text in enumerate([f"SCORE {stats[0]}", f"LEVEL {stats[1]}", f"LINES {stats[2]}"]):
+                parts.append(move_cursor(self.top + 1 + line, self.hud_col) + text + "\033[K")
+
+        if next_shape is not None and next_shape != self.prev_next:
+            self.prev_next = next_shape
+            parts.append(move_cursor(self.top + 5, self.hud_col) + "NEXT")
+            shape = ALL_SHAPES[next_shape[0]]
+            for row in range(len(shape)):
+                parts.append(move_cursor(self.top + 6 + row, self.hud_col))
+                for cell in shape[row]:
+                    parts.append(CELL_CODES[next_shape[1]] + "  " if cell != 0 else RESET + "  ")
+
+                parts.append(RESET)
+
+        return "".join(parts)
+
+    def frame(self) -> str:
+        """
+        Escape sequences that bring the terminal from the last frame to the current engine state
+        :return: str, empty if nothing changed
+        """
+        return self.render(self.cell_values(), engine_stats(self.engine), engine_next(self.engine))
+
+    def render(self, cells: List[int], stats: Tuple[int, int, int], next_shape: Optional[Tuple[int, int]]) -> str:
+        """
+        Escape sequences that bring the terminal from the last frame to the given one
+        :param cells: list of frame buffer values, see cell_values
+        :param stats: (score, level, lines)
+        :param next_shape: (shape id, palette index) or None
+        :return: str, empty if nothing changed
+        """
+        full = self.prev_cells is None
+        frame = (self.border() if full else "") + self.board(cells) + self.hud(stats, next_shape)
+        self.prev_cells = cells
+        return frame
+
+    def draw(self, frame: Optional[str] = None) -> int:
+        """
+        Write the frame with a single write call
+        :param frame: str from render(), default is the frame of the engine
+        :return: int, amount of characters written
+        """
+        if frame is None:
+            frame = self.frame()
+
+        if frame:
+            self.out.write(frame)
+            self.out.flush()
+
+        return len(frame)
+
+
+def watch(engine: Engine, policy, rng: random.Random, fps: float = 60, max_frames: int = 1_000_000) -> None:
+    """
+    Play a headless game in real time and draw it to the terminal
+    :param engine: Engine
+    :param policy: runner policy, called once per gravity step
+    :param rng: random generator of the policy
+    :param fps: float, frames per second for both engine and drawing
+    :param max_frames: int, stop after this many frames
+    """
+    renderer = TerminalRender(engine)
+    renderer.start()
+    frame_time = 1 / fps
+    next_frame = time.perf_counter()
+    try:
+        while not engine.game_end and engine.frames < max_frames:
+            if engine.frames % engine.speed == 0:
+                engine.key_buffer.extend(policy(engine, rng))
+
+            engine.update()
+            renderer.draw()
+
+            # Sleep the rest of the frame, nothing is done while waiting
+            next_frame += frame_time
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        renderer.close()
+
+
+def main():
+    from runner import POLICIES, load_policy
+
+    parser = argparse.ArgumentParser(description="Watch a headless game in the terminal")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--policy", default="random", help=f"one of {list(POLICIES)} or module:function")
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--max-frames", type=int, default=1_000_000)
+    parser.add_argument("--width", type=int, default=COLS, help="board width")
+    parser.add_argument("--height", type=int, default=ROWS, help="board height")
+    args = parser.parse_args()
+
+    engine = Engine(args.seed, width=args.width, height=args.height)
+    watch(engine, load_policy(args.policy), random.Random(f"policy {engine.seed}"), args.fps, args.max_frames)
+    print(f"score {engine.score}  level {engine.level}  lines {engine.total_tetris_rows}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import threading
+import time
+from typing import Callable, List
+from engine import Engine
+
+"""
+Fixed timestep simulation: the engine is advanced a fixed amount of ticks per real second no matter how often
+the game is drawn. Engine.speed is counted in ticks, so slow drawing drops frames instead of slowing the game down
+and fast drawing does not speed it up.
+"""
+
+# Engine ticks per second, Engine.speed values were tuned for this
+TICK_RATE = 60
+
+
+class FixedTimestep:
+    def __init__(self, engine: Engine, tick_rate: float = TICK_RATE, max_catch_up: int = 30,
+                 clock: Callable[[], float] = time.perf_counter):
+        """
+        :param engine: Engine to advance
+        :param tick_rate: float, engine ticks per second
+        :param max_catch_up: int, most ticks run by one advance, older backlog is dropped (e.g. process was suspended)
+        :param clock: function returning current time in seconds
+        """
+        self.engine = engine
+        self.tick_time = 1 / tick_rate
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+
+        # Real time not yet simulated
+        self.accumulator = 0.0
+        self.last_time = clock()
+        self.ticks = 0
+        self.dropped_ticks = 0
+
+    def reset_clock(self) -> None:
+        # Start counting from now, e.g. when the game loop starts after loading
+        self.accumulator = 0.0
+        self.last_time = self.clock()
+
+    def advance(self) -> int:
+        """
+        Run every tick that is due since the last call
+        :return: int, amount of ticks run
+        """
+        now = self.clock()
+        self.accumulator += now - self.last_time
+        self.last_time = now
+
+        ticks = int(self.accumulator / self.tick_time)
+        if ticks > self.max_catch_up:
+            self.dropped_ticks += ticks - self.max_catch_up
+            ticks = self.max_catch_up
+            self.accumulator = ticks * self.tick_time
+
+        self.accumulator -= ticks * self.tick_time
+        if ticks != 0:
+            # Ticks without anything happening are skipped by step, catching up is cheap
+            self.engine.step(ticks)
+            self.ticks += ticks
+
+        return ticks
+
+    def alpha(self) -> float:
+        # Fraction of the next tick that has passed, can be used to interpolate drawing
+        return self.accumulator / self.tick_time
+
+    def time_until_tick(self) -> float:
+        return max(0.0, self.tick_time - self.accumulator - (self.clock() - self.last_time))
+
+
+def snapshot(engine: Engine) -> Engine:
+    """
+    Copy of the engine that nobody changes, so it can be drawn in one thread while the engine keeps running
+    in another
+    :param engine: Engine
+    :return: Engine, only for reading
+    """
+    return engine.clone()
+
+
+class SimulationThread(threading.Thread):
+    """
+    Runs FixedTimestep on its own thread. Keys are passed in with send_keys and the renderer
+    reads the newest snapshot from self.latest, so drawing never blocks the game
+    """
+
+    def __init__(self, engine: Engine, tick_rate: float = TICK_RATE, max_catch_up: int = 30):
+        super().__init__(name="simulation", daemon=True)
+        self.engine = engine
+        self.timestep = FixedTimestep(engine, tick_rate, max_catch_up)
+        self.lock = threading.Lock()
+        self.pending_keys: List[str] = []
+        self.stop_event = threading.Event()
+
+        # Replaced (never changed) after every tick, reading the attribute is atomic
+        self.latest: Engine = snapshot(engine)
+
+    def send_keys(self, *keys: str) -> None:
+        # Keys are given to the engine before the next tick
+        with self.lock:
+            self.pending_keys.extend(keys)
+
+    def run(self) -> None:
+        self.timestep.reset_clock()
+        while not self.stop_event.is_set() and not self.engine.game_end:
+            with self.lock:
+                keys, self.pending_keys = self.pending_keys, []
+
+            self.engine.key_buffer.extend(keys)
+            if self.timestep.advance() != 0:
+                self.latest = snapshot(self.engine)
+
+            self.stop_event.wait(self.timestep.time_until_tick())
+
+        self.latest = snapshot(self.engine)
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()